@@ -12,10 +12,17 @@ DB_CONFIG = {
 # Gmail API settings
 GMAIL_SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
 CREDENTIALS_FILE = 'credentials.json'
-TOKEN_FILE = 'token.pickle'
+TOKEN_FILE = 'token.json'
+LEGACY_TOKEN_FILE = 'token.pickle'  # migrated to TOKEN_FILE on first run
 
 # Processing settings
 
 # Setting the maximum number of emails to fetch to an optimal value
 MAX_EMAILS_TO_FETCH = 50
-DEFAULT_RULES_FILE = 'rules.json'
\ No newline at end of file
+DEFAULT_RULES_FILE = 'rules.json'
+
+# Number of message batches fetched concurrently (kept low for Gmail rate limits)
+MAX_FETCH_WORKERS = 4
+
+# Number of emails whose Gmail actions run concurrently
+MAX_ACTION_WORKERS = 10
@@ -5,12 +5,15 @@ Usage:
     python3 fetch_emails.py              # Fetch 50 emails (default)
     python3 fetch_emails.py 100          # Fetch 100 emails
     python3 fetch_emails.py --max 200    # Fetch 200 emails
+    python3 fetch_emails.py --rules custom_rules.json
 """
+import os
 import sys
 import argparse
-from src.gmail_client import GmailClient
 from src.database import EmailDatabase
-from config import DB_CONFIG, MAX_EMAILS_TO_FETCH
+from src.rule_engine import RuleEngine
+from src.rule_validator import RuleValidationError
+from config import DB_CONFIG, MAX_EMAILS_TO_FETCH, DEFAULT_RULES_FILE
 
 def parse_arguments():
     parser = argparse.ArgumentParser(
@@ -33,10 +36,29 @@ def parse_arguments():
         help='Maximum emails to fetch (alternative syntax)'
     )
     
+    parser.add_argument(
+        '--rules', '-r',
+        default=DEFAULT_RULES_FILE,
+        help=f'Rules file deciding whether bodies are needed (default: {DEFAULT_RULES_FILE})'
+    )
+    
     return parser.parse_args()
 
+def rules_need_body(rules_file):
+    """Return True unless the rules file is valid and never checks the message body"""
+    if not os.path.exists(rules_file):
+        return True
+    try:
+        return RuleEngine(rules_file, verbose=False).needs_body
+    except RuleValidationError:
+        return True
+
 def main():
     args = parse_arguments()
+
+    # Imported after argument parsing so --help does not load the Google client
+    from src.gmail_client import GmailClient
+
     max_emails = args.max_emails_flag if args.max_emails_flag else args.max_emails
     
     print("=" * 60)
@@ -45,8 +67,13 @@ def main():
     print(f"Max emails to fetch: {max_emails}")
     print("=" * 60)
     
+    needs_body = rules_need_body(args.rules)
+    if not needs_body:
+        print(f"No rule in {args.rules} checks the message body; fetching headers only")
+        print("  (bodies already stored are kept; new emails are stored without one)")
+    
     print("\nStep 1: Authenticating with Gmail...")
-    gmail = GmailClient()
+    gmail = GmailClient(needs_body=needs_body)
     
     print("\nStep 2: Connecting to database...")
     db = EmailDatabase(DB_CONFIG)
@@ -8,11 +8,48 @@ Usage:
 """
 import sys
 import argparse
-from src.gmail_client import GmailClient
+import glob
+import hashlib
+import os
+import pickle
+import re
+import stat
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import islice
+from typing import Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import src.rule_engine
+import src.rule_validator
 from src.database import EmailDatabase
 from src.rule_engine import RuleEngine
 from src.rule_validator import RuleValidationError
-from config import DB_CONFIG, DEFAULT_RULES_FILE
+from config import DB_CONFIG, DEFAULT_RULES_FILE, MAX_ACTION_WORKERS
+
+
+# Modules whose source is part of the rules cache key
+_ENGINE_SOURCES = (src.rule_engine.__file__, src.rule_validator.__file__)
+
+# Minimum seconds between progress line updates
+PROGRESS_INTERVAL = 0.5
+
+# Emails evaluated together so repeated header values share index lookups
+EVAL_BATCH_SIZE = 500
+
+# Labels kept when a message is moved (everything else is replaced)
+_SYSTEM_LABELS = frozenset(
+    (
+        "UNREAD",
+        "STARRED",
+        "IMPORTANT",
+        "CATEGORY_PERSONAL",
+        "CATEGORY_SOCIAL",
+        "CATEGORY_PROMOTIONS",
+        "CATEGORY_UPDATES",
+        "CATEGORY_FORUMS",
+    )
+)
 
 
 def parse_arguments():
@@ -41,80 +78,271 @@ Examples:
         help="Path to rules JSON file (alternative syntax)",
     )
 
+    parser.add_argument(
+        "--verbose",
+        "-v",
+        action="store_true",
+        help="Print every matched rule, action and label change",
+    )
+
     return parser.parse_args()
 
 
-def execute_action(gmail: GmailClient, email: dict, action: dict) -> bool:
+def _is_private_file(st: os.stat_result) -> bool:
+    """True if the file is owned by this user and not group/world-writable"""
+    getuid = getattr(os, "getuid", None)  # not available on Windows
+    if getuid is not None and st.st_uid != getuid():
+        return False
+    return not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def load_engine(rules_file: str) -> RuleEngine:
+    """
+    Load a validated RuleEngine, reusing a pickled copy when the rules
+    file is unchanged
+
+    The cache sits next to the rules file and is keyed by a hash of its
+    contents, RuleEngine.CACHE_VERSION and the source of the engine and
+    validator modules, so editing the rules or the code that compiles them
+    triggers a fresh parse and validation.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(RuleEngine.CACHE_VERSION).encode())
+    for source in _ENGINE_SOURCES:
+        with open(source, "rb") as f:
+            digest.update(f.read())
+    with open(rules_file, "rb") as f:
+        digest.update(f.read())
+    digest = digest.hexdigest()
+    cache_file = f"{rules_file}.{digest}.pkl"
+
+    # Remove caches left behind by previous versions of this rules file only
+    # (not those of e.g. rules.json.old, which share the prefix)
+    stale_name = re.compile(
+        re.escape(os.path.basename(rules_file)) + r"\.[0-9a-f]{32}\.pkl"
+    )
+    for stale in glob.glob(f"{glob.escape(rules_file)}.*.pkl"):
+        if stale != cache_file and stale_name.fullmatch(os.path.basename(stale)):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, "rb") as f:
+                # Unpickling runs code, so only trust a cache nobody else
+                # could have written
+                if not _is_private_file(os.fstat(f.fileno())):
+                    raise ValueError("not owned by this user or writable by others")
+                engine = pickle.load(f)
+            RuleEngine._print_warnings(engine.warnings)
+            print(f"Loaded {len(engine.rules)} validated rules from cache")
+            return engine
+        except Exception as e:
+            print(f"Ignoring unreadable rules cache: {e}")
+
+    engine = RuleEngine(rules_file)
+
+    try:
+        # A rejected cache is replaced rather than rewritten, so the new
+        # file gets this user as owner and owner-only permissions
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+        fd = os.open(cache_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(engine, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        print(f"Could not write rules cache: {e}")
+
+    return engine
+
+
+def evaluate_in_batches(engine: RuleEngine, emails, batch_size: int = EVAL_BATCH_SIZE):
+    """
+    Yield (email, actions) for a stream of emails, evaluating them
+    batch_size at a time so only one batch is held in memory
+    """
+    emails = iter(emails)
+    while True:
+        batch = list(islice(emails, batch_size))
+        if not batch:
+            return
+        yield from zip(batch, engine.evaluate_rules_batch(batch))
+
+
+@dataclass(frozen=True)
+class ActionPlan:
+    """Precompiled label change for one kind of rule action"""
+
+    description: str
+    add: Tuple[str, ...] = ()
+    remove: Tuple[str, ...] = ()
+    keep_only_system: bool = False  # move_message drops all non-system labels
+
+    def apply(self, email: dict, verbose: bool = True) -> bool:
+        """
+        Apply the label change to the email dict
+
+        The labels list is replaced rather than modified in place, so callers
+        can keep a reference to the original list without copying it.
+
+        Returns:
+            True if the email's set of labels changed
+        """
+        if verbose:
+            print(self.description)
+        labels = email.get("labels")
+        if labels is None:
+            if not self.keep_only_system:
+                return False
+            labels = []
+
+        if self.keep_only_system:
+            new_labels = [label for label in labels if label in _SYSTEM_LABELS]
+        else:
+            new_labels = [label for label in labels if label not in self.remove]
+        new_labels += [label for label in self.add if label not in new_labels]
+
+        if "labels" in email and set(new_labels) == set(labels):
+            return False
+        email["labels"] = new_labels
+        return True
+
+
+@lru_cache(maxsize=None)
+def compile_action(
+    action_type: str, destination: Optional[str] = None
+) -> Optional[ActionPlan]:
+    """Build (once per distinct action) the plan for an action, None if unknown"""
+    if action_type == "mark_as_read":
+        return ActionPlan("Marking as read...", remove=("UNREAD",))
+
+    if action_type == "mark_as_unread":
+        return ActionPlan("Marking as unread...", add=("UNREAD",))
+
+    if action_type == "move_message":
+        if destination is None:
+            destination = "Processed"
+        if destination.lower() in ["inbox", "trash", "spam", "sent", "draft"]:
+            destination = destination.upper()
+        return ActionPlan(
+            f"Moving to '{destination}'...", add=(destination,), keep_only_system=True
+        )
+
+    return None
+
+
+def execute_action(
+    email: dict, action: dict, verbose: bool = True
+) -> Tuple[bool, bool]:
     """
-    Execute an action on an email and update the email dict in place
+    Apply an action to the email dict's labels
+
+    Gmail is not called here: main() collects the resulting label changes
+    and sends them with one batchModify request per distinct change.
 
     Args:
-        gmail: Gmail client
         email: Email dict (will be modified to reflect changes)
         action: Action to execute
+        verbose: Print the action being applied
 
     Returns:
-        True if action succeeded, False otherwise
+        (applied, mutated): whether the action was applied and whether it
+        changed the email's set of labels
     """
-    action_type = action["type"]
+    plan = compile_action(action["type"], action.get("destination"))
+    if plan is None:
+        print(f"Unknown action type: {action['type']}")
+        return False, False
 
-    try:
-        if action_type == "mark_as_read":
-            print(f"Marking as read...")
-            success = gmail.mark_as_read(email["id"])
-
-            if success:
-                # Update local email state to reflect change
-                if "labels" in email and "UNREAD" in email["labels"]:
-                    email["labels"] = [l for l in email["labels"] if l != "UNREAD"]
-            return success
-
-        elif action_type == "mark_as_unread":
-            print(f"Marking as unread...")
-            success = gmail.mark_as_unread(email["id"])
-
-            if success:
-                if "labels" in email and "UNREAD" not in email["labels"]:
-                    email["labels"].append("UNREAD")
-            return success
-
-        elif action_type == "move_message":
-            destination = action.get("destination", "Processed")
-            if destination.lower() in ["inbox", "trash", "spam", "sent", "draft"]:
-                destination = destination.upper()
-            print(f"Moving to '{destination}'...")
-            success = gmail.move_message(email["id"], destination)
-
-            if success:
-                # Keep only system labels, add destination
-                if "labels" in email:
-                    system_labels = [
-                        "UNREAD",
-                        "STARRED",
-                        "IMPORTANT",
-                        "CATEGORY_PERSONAL",
-                        "CATEGORY_SOCIAL",
-                        "CATEGORY_PROMOTIONS",
-                        "CATEGORY_UPDATES",
-                        "CATEGORY_FORUMS",
-                    ]
-                    email["labels"] = [l for l in email["labels"] if l in system_labels]
-                    email["labels"].append(destination)
-                else:
-                    email["labels"] = [destination]
-            return success
+    return True, plan.apply(email, verbose)
 
-        else:
-            print(f"Unknown action type: {action_type}")
-            return False
 
-    except Exception as e:
-        print(f"Error executing action: {e}")
-        return False
+def stage_label_change(
+    email: dict, actions, label_changes: dict, verbose: bool = True
+) -> int:
+    """
+    Apply an email's matched actions and queue the resulting label change
+
+    Emails with the same change share one entry of label_changes, keyed by
+    (labels to add, labels to remove), so send_label_changes() makes one
+    batchModify request for all of them.
+
+    Returns:
+        Number of applied actions that need no Gmail request; actions of a
+        queued email are counted once Gmail accepts the change
+    """
+    # execute_action never edits the list in place, so no copy is needed
+    original_labels = email.get("labels") or []
+    applied = 0
+    dirty = False
+    for action in actions:
+        success, mutated = execute_action(email, action, verbose)
+        applied += success
+        dirty = dirty or mutated
+
+    if dirty:
+        # Later actions may undo earlier ones, so diff the end state
+        current_labels = frozenset(email.get("labels", []))
+        key = (
+            current_labels - frozenset(original_labels),
+            frozenset(original_labels) - current_labels,
+        )
+        if key[0] or key[1]:
+            label_changes.setdefault(key, []).append((email, original_labels, applied))
+            return 0
+
+    return applied
+
+
+def send_label_changes(gmail, label_changes: dict, verbose: bool = True):
+    """
+    Send each queued label change to Gmail with one batchModify call
+
+    Emails Gmail did not change get their original labels back so the
+    database keeps matching the mailbox.
+
+    Returns:
+        (emails_to_update, action_count) for the emails Gmail changed
+    """
+    emails_to_update = []
+    action_count = 0
+
+    # Requests are network-bound so independent groups are sent concurrently
+    with ThreadPoolExecutor(max_workers=MAX_ACTION_WORKERS) as executor:
+        futures = {
+            executor.submit(
+                gmail.batch_modify,
+                [email["id"] for email, _, _ in group],
+                sorted(add_labels),
+                sorted(remove_labels),
+            ): group
+            for (add_labels, remove_labels), group in label_changes.items()
+        }
+
+        for future in as_completed(futures):
+            modified = set(future.result())
+            for email, original_labels, applied in futures[future]:
+                if email["id"] in modified:
+                    # Labels changed - need to update database
+                    action_count += applied
+                    emails_to_update.append(email)
+                    if verbose:
+                        print(f"Labels: {original_labels} → {email['labels']}")
+                else:
+                    # Gmail was not updated - keep the stored state
+                    email["labels"] = original_labels
+
+    return emails_to_update, action_count
 
 
 def main():
     args = parse_arguments()
+
+    # Imported after argument parsing so --help does not load the Google client
+    from src.gmail_client import GmailClient
+
     rules_file = args.rules_file_flag if args.rules_file_flag else args.rules_file
 
     print("=" * 60)
@@ -130,7 +358,8 @@ def main():
 
     # Load and validate rules (validation integrated in RuleEngine)
     try:
-        engine = RuleEngine(rules_file)
+        engine = load_engine(rules_file)
+        engine.verbose = args.verbose
     except RuleValidationError:
         print("\nCannot proceed due to validation errors.")
         print("Fix the errors above and try again.")
@@ -142,43 +371,56 @@ def main():
         print(f"\nError loading rules: {e}")
         sys.exit(1)
 
-    # Load emails from database
+    # Check emails in database (they are streamed during evaluation)
     print("\nStep 2: Loading emails from database...")
-    emails = db.get_all_emails()
+    email_total = db.count_emails()
 
-    if not emails:
+    if not email_total:
         print("No emails found in database. Run fetch_emails.py first.")
         return
 
-    print(f"Loaded {len(emails)} emails")
+    print(f"Found {email_total} emails")
 
     # Process each email
     print(f"\nStep 3: Evaluating rules for each email...")
     print("-" * 60)
 
+    evaluated_count = 0
     processed_count = 0
     action_count = 0
-    emails_to_update = []  # Track emails with label changes
+    # (labels to add, labels to remove) -> [(email, original_labels, applied)]
+    label_changes = {}
 
-    for i, email in enumerate(emails, 1):
+    last_progress = 0.0
+    engine.set_now()  # one clock reading for every date condition in this run
 
-        # Store original labels to detect changes
-        original_labels = email.get("labels", []).copy() if email.get("labels") else []
+    # Verbose output stays per email: each match is followed by its actions
+    batch_size = 1 if args.verbose else EVAL_BATCH_SIZE
+    evaluations = evaluate_in_batches(engine, db.iter_all_emails(), batch_size)
 
-        actions = engine.evaluate_rules(email)
+    for evaluated_count, (email, actions) in enumerate(evaluations, 1):
+        if not args.verbose:
+            # A throttled progress line instead of output for every email
+            now = time.monotonic()
+            if now - last_progress >= PROGRESS_INTERVAL:
+                print(f"  Evaluated {evaluated_count}/{email_total} emails", end="\r")
+                last_progress = now
 
         if actions:
             processed_count += 1
-            for action in actions:
-                if execute_action(gmail, email, action):
-                    action_count += 1
+            action_count += stage_label_change(
+                email, actions, label_changes, args.verbose
+            )
+
+    if not args.verbose:
+        print(f"  Evaluated {evaluated_count}/{email_total} emails")
+        print(f"  Matched {processed_count} emails")
 
-            # Check if labels actually changed
-            current_labels = email.get("labels", [])
-            if sorted(original_labels) != sorted(current_labels):
-                # Labels changed - need to update database
-                emails_to_update.append(email)
-                print(f"Labels: {original_labels} → {current_labels}")
+    # One batchModify per distinct label change
+    emails_to_update, sent_actions = send_label_changes(
+        gmail, label_changes, args.verbose
+    )
+    action_count += sent_actions
 
     print("\n" + "-" * 60)
 
@@ -188,8 +430,7 @@ def main():
             f"\nStep 4: Updating database with {len(emails_to_update)} changed emails..."
         )
 
-        for email in emails_to_update:
-            db.insert_or_update_email(email)
+        db.batch_upsert(emails_to_update)
 
         print(f"Database updated with new versions")
     else:
@@ -198,7 +439,7 @@ def main():
     # Summary
     print("\n" + "=" * 60)
     print(f"COMPLETE:")
-    print(f"Emails processed: {processed_count}/{len(emails)}")
+    print(f"Emails processed: {processed_count}/{evaluated_count}")
     print(f"Actions executed: {action_count}")
     print(f"Database versions created: {len(emails_to_update)}")
     print("=" * 60)
@@ -3,321 +3,744 @@ Database layer with temporal tracking (bitemporal design)
 Tracks email state changes over time
 """
 import psycopg2
-from psycopg2.extras import RealDictCursor, execute_batch
-from typing import List, Dict, Optional
+from psycopg2.extras import RealDictCursor, execute_batch, execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from contextlib import contextmanager
+import hashlib
+import io
+import itertools
+import threading
+import weakref
+from typing import List, Dict, Iterator, Optional
 from datetime import datetime
-import json
+
+# Connection pool bounds (one connection per concurrent caller)
+POOL_MIN_CONNECTIONS = 1
+POOL_MAX_CONNECTIONS = 8
+
+# Bump whenever create_tables changes so existing databases are upgraded
+SCHEMA_VERSION = 2
+
+# Rows per execute_values statement in batch writes
+BATCH_PAGE_SIZE = 500
+
+# New versions at or above this count are loaded with COPY instead of INSERT
+COPY_MIN_ROWS = 1000
+
+
+# insert_or_update_email as one prepared statement ($1..$10 follow
+# _version_params); prepared once per pooled connection. A NULL message ($7)
+# means the body was not fetched, so the stored one is kept.
+UPSERT_STATEMENT = "upsert_email"
+UPSERT_SQL = """
+PREPARE upsert_email (text, timestamp, text, text, text, text, text,
+                      timestamp, text[], bigint) AS
+    WITH existing AS (
+        SELECT email_id, labels_hash, COALESCE(labels, '{}') AS labels, message
+        FROM emails
+        WHERE email_id = $1 AND is_current = TRUE
+        FOR UPDATE
+    ),
+    changed AS (
+        SELECT email_id FROM existing
+        WHERE CASE
+            WHEN labels_hash IS NOT NULL
+                THEN labels_hash <> $10
+            ELSE NOT (labels @> $9 AND labels <@ $9)
+        END
+    ),
+    closed AS (
+        UPDATE emails
+        SET valid_to = $2, is_current = FALSE
+        WHERE email_id IN (SELECT email_id FROM changed)
+        AND is_current = TRUE
+    ),
+    refreshed AS (
+        UPDATE emails
+        SET
+            thread_id = $3,
+            from_email = $4,
+            to_email = $5,
+            subject = $6,
+            message = COALESCE($7, message),
+            received_date = $8
+        WHERE email_id IN (SELECT email_id FROM existing)
+        AND NOT EXISTS (SELECT 1 FROM changed)
+        AND is_current = TRUE
+    )
+    INSERT INTO emails
+    (email_id, valid_from, thread_id, from_email, to_email,
+     subject, message, received_date, labels, labels_hash,
+     valid_to, is_current)
+    SELECT $1, $2, $3, $4, $5,
+           $6, COALESCE($7, (SELECT message FROM existing), ''), $8,
+           $9, $10, NULL, TRUE
+    WHERE NOT EXISTS (SELECT 1 FROM existing)
+    OR EXISTS (SELECT 1 FROM changed)
+"""
+
+
+def labels_fingerprint(labels) -> int:
+    """Order-insensitive signed 64-bit fingerprint of a label set"""
+    joined = "\x1f".join(sorted(set(labels or [])))
+    digest = hashlib.blake2b(joined.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def _csv_field(value) -> str:
+    """Quote a value for COPY ... CSV; None stays unquoted so it loads as NULL"""
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        # TEXT[] literal; backslash and quote escapes belong to the array syntax
+        value = "{%s}" % ",".join(
+            '"%s"' % str(item).replace("\\", "\\\\").replace('"', '\\"')
+            for item in value
+        )
+    return '"%s"' % str(value).replace('"', '""')
+
+
+class _Savepoint:
+    """
+    Stands in for the connection pinned by EmailDatabase.transaction().
+    Each borrow opens a savepoint, so a method's commit() only releases its
+    own work into the enclosing transaction and rollback() undoes only that.
+    """
+
+    _names = itertools.count()
+
+    def __init__(self, conn):
+        self.raw = conn
+        self._name = f"db_call_{next(self._names)}"
+        self._open = True
+        with conn.cursor() as cursor:
+            cursor.execute(f"SAVEPOINT {self._name}")
+
+    def commit(self):
+        if self._open:
+            with self.raw.cursor() as cursor:
+                cursor.execute(f"RELEASE SAVEPOINT {self._name}")
+            self._open = False
+
+    def rollback(self):
+        if self._open:
+            with self.raw.cursor() as cursor:
+                cursor.execute(f"ROLLBACK TO SAVEPOINT {self._name}")
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
 
 
 class EmailDatabase:
-    def __init__(self, db_config):
+    def __init__(self, db_config, clock=datetime.now):
         self.db_config = db_config
-        self.create_tables()
+        self._now = clock  # source of valid_from / valid_to timestamps
+        self._prepared = weakref.WeakSet()  # connections with UPSERT_SQL prepared
+        self._local = threading.local()  # connection pinned by transaction()
+        self.pool = ThreadedConnectionPool(
+            POOL_MIN_CONNECTIONS, POOL_MAX_CONNECTIONS, **db_config
+        )
+        # Skip the DDL round-trips when the schema is already up to date
+        if self._schema_version() != SCHEMA_VERSION:
+            self.create_tables()
 
     def get_connection(self):
-        """Get database connection"""
+        """Get a standalone database connection (caller must close it)"""
         return psycopg2.connect(**self.db_config)
 
+    @contextmanager
+    def _conn(self):
+        """Borrow a pooled connection and return it to the pool afterwards"""
+        pinned = getattr(self._local, "conn", None)
+        if pinned is not None:
+            savepoint = _Savepoint(pinned)
+            yield savepoint
+            savepoint.commit()
+            return
+        conn = self.pool.getconn()
+        try:
+            yield conn
+        finally:
+            self.pool.putconn(conn)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run every call made on this thread inside the block in one database
+        transaction, committed once on exit and rolled back on error.
+        Nested blocks join the outer transaction.
+        """
+        if getattr(self._local, "conn", None) is not None:
+            yield self
+            return
+        with self._conn() as conn:
+            self._local.conn = conn
+            try:
+                yield self
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                self._local.conn = None
+
+    def close(self):
+        """Close all pooled connections"""
+        self.pool.closeall()
+
+    def _schema_version(self) -> Optional[int]:
+        """Return the recorded schema version, or None if not recorded"""
+        with self._conn() as conn:
+            cursor = conn.cursor()
+
+            try:
+                cursor.execute("SELECT version FROM schema_meta LIMIT 1")
+                row = cursor.fetchone()
+                return row[0] if row else None
+            except psycopg2.Error:
+                conn.rollback()
+                return None
+            finally:
+                cursor.close()
+
     def create_tables(self):
         """Create database tables with temporal tracking"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        try:
-            # Create emails table with temporal columns
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS emails (
-                    email_id VARCHAR(255) NOT NULL,
-                    valid_from TIMESTAMP NOT NULL,
+        with self._conn() as conn:
+            cursor = conn.cursor()
+
+            try:
+                # Create emails table with temporal columns
+                cursor.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS emails (
+                        email_id VARCHAR(255) NOT NULL,
+                        valid_from TIMESTAMP NOT NULL,
                     
-                    thread_id VARCHAR(255),
-                    from_email TEXT,
-                    to_email TEXT,
-                    subject TEXT,
-                    message TEXT,
-                    received_date TIMESTAMP,
-                    labels TEXT,
+                        thread_id VARCHAR(255),
+                        from_email TEXT,
+                        to_email TEXT,
+                        subject TEXT,
+                        message TEXT,
+                        received_date TIMESTAMP,
+                        labels TEXT[],
+                        labels_hash BIGINT,
                     
-                    valid_to TIMESTAMP,
-                    is_current BOOLEAN DEFAULT TRUE,
-                    fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        valid_to TIMESTAMP,
+                        is_current BOOLEAN DEFAULT TRUE,
+                        fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     
-                    PRIMARY KEY (email_id, valid_from),
-                    CONSTRAINT valid_period CHECK (valid_to IS NULL OR valid_to > valid_from)
+                        PRIMARY KEY (email_id, valid_from),
+                        CONSTRAINT valid_period CHECK (valid_to IS NULL OR valid_to > valid_from)
+                    )
+                """
                 )
-            """
-            )
 
-            # Indexes for performance
-            cursor.execute(
+                self._migrate_labels_column(cursor)
+                cursor.execute(
+                    "ALTER TABLE emails ADD COLUMN IF NOT EXISTS labels_hash BIGINT"
+                )
+
+                # Indexes for performance
+                cursor.execute(
+                    """
+                    CREATE INDEX IF NOT EXISTS idx_email_current 
+                    ON emails(email_id) WHERE is_current = TRUE
                 """
-                CREATE INDEX IF NOT EXISTS idx_email_current 
-                ON emails(email_id) WHERE is_current = TRUE
-            """
-            )
+                )
 
-            cursor.execute(
+                cursor.execute(
+                    """
+                    CREATE INDEX IF NOT EXISTS idx_from_email 
+                    ON emails(from_email) WHERE is_current = TRUE
                 """
-                CREATE INDEX IF NOT EXISTS idx_from_email 
-                ON emails(from_email) WHERE is_current = TRUE
-            """
-            )
+                )
 
-            cursor.execute(
+                cursor.execute(
+                    """
+                    CREATE INDEX IF NOT EXISTS idx_subject 
+                    ON emails(subject) WHERE is_current = TRUE
                 """
-                CREATE INDEX IF NOT EXISTS idx_subject 
-                ON emails(subject) WHERE is_current = TRUE
-            """
-            )
+                )
 
-            cursor.execute(
+                # Matches iter_all_emails' ORDER BY so the read path needs no
+                # sort. No INCLUDE columns: that query reads every column, so
+                # they could never give an index-only scan, and a long labels
+                # array could exceed the btree entry size limit.
+                cursor.execute("DROP INDEX IF EXISTS idx_received_date")
+                cursor.execute("DROP INDEX IF EXISTS idx_current_by_date")
+                cursor.execute(
+                    """
+                    CREATE INDEX IF NOT EXISTS idx_current_received
+                    ON emails(received_date DESC)
+                    WHERE is_current = TRUE
                 """
-                CREATE INDEX IF NOT EXISTS idx_received_date 
-                ON emails(received_date) WHERE is_current = TRUE
-            """
-            )
+                )
+
+                cursor.execute(
+                    "CREATE TABLE IF NOT EXISTS schema_meta (version INTEGER NOT NULL)"
+                )
+                cursor.execute("DELETE FROM schema_meta")
+                cursor.execute(
+                    "INSERT INTO schema_meta (version) VALUES (%s)", (SCHEMA_VERSION,)
+                )
 
-            conn.commit()
-            print("Database tables created/verified with temporal tracking")
+                conn.commit()
+                print("Database tables created/verified with temporal tracking")
 
-        except Exception as e:
-            print(f"Error creating tables: {e}")
-            conn.rollback()
-        finally:
-            cursor.close()
-            conn.close()
+            except Exception as e:
+                print(f"Error creating tables: {e}")
+                conn.rollback()
+            finally:
+                cursor.close()
+
+    def _migrate_labels_column(self, cursor):
+        """Convert a legacy JSON-encoded TEXT labels column to TEXT[]"""
+        cursor.execute(
+            """
+            SELECT data_type FROM information_schema.columns
+            WHERE table_schema = current_schema()
+            AND table_name = 'emails' AND column_name = 'labels'
+        """
+        )
+        row = cursor.fetchone()
+        if not row or row[0] != "text":
+            return
+
+        # ALTER ... USING cannot contain a subquery, so copy via a new column
+        cursor.execute("ALTER TABLE emails ADD COLUMN labels_array TEXT[]")
+        cursor.execute(
+            """
+            UPDATE emails
+            SET labels_array = ARRAY(SELECT jsonb_array_elements_text(labels::jsonb))
+            WHERE jsonb_typeof(labels::jsonb) = 'array'
+        """
+        )
+        cursor.execute("ALTER TABLE emails DROP COLUMN labels")
+        cursor.execute("ALTER TABLE emails RENAME COLUMN labels_array TO labels")
+        print("Migrated labels column to TEXT[]")
 
     def insert_or_update_email(self, email_data: Dict):
-        """Insert email or create new version if changed"""
-        conn = self.get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        """
+        Insert email or create new version if changed.
+        Change detection runs server-side in a single statement: labels are
+        compared by labels_hash (as sets for rows written before that column
+        existed), a changed email has its current version closed and a new
+        one inserted, an unchanged email has its other fields refreshed in
+        place.
+        """
+        with self._conn() as conn:
+            cursor = conn.cursor()
+
+            try:
+                self._prepare_upsert(conn, cursor)
+                cursor.execute(
+                    f"EXECUTE {UPSERT_STATEMENT} (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                    self._version_params(email_data, self._now()),
+                )
 
-        try:
-            email_id = email_data["id"]
-            now = datetime.now()
+                conn.commit()
+
+            except Exception as e:
+                print(f"Error inserting email: {e}")
+                conn.rollback()
+            finally:
+                cursor.close()
+
+    def _prepare_upsert(self, conn, cursor):
+        """PREPARE the upsert statement the first time a connection uses it"""
+        conn = getattr(conn, "raw", conn)
+        if conn not in self._prepared:
+            cursor.execute(UPSERT_SQL)
+            self._prepared.add(conn)
+
+    def _version_params(self, email_data: Dict, valid_from: datetime) -> tuple:
+        """Build the statement parameters ($1..$10) for insert_or_update_email"""
+        return (
+            email_data["id"],
+            valid_from,
+            email_data.get("thread_id", ""),
+            email_data.get("from", ""),
+            email_data.get("to", ""),
+            email_data.get("subject", ""),
+            email_data.get("message"),  # None: body not fetched, keep stored
+            email_data.get("received_date"),
+            email_data.get("labels") or [],
+            labels_fingerprint(email_data.get("labels")),
+        )
 
-            cursor.execute(
-                """
-                SELECT * FROM emails 
-                WHERE email_id = %s AND is_current = TRUE
-            """,
-                (email_id,),
-            )
+    def _has_email_changed(
+        self, labels_hash: Optional[int], labels: Optional[List[str]], new_data: Dict
+    ) -> bool:
+        """
+        Check if email data has changed (mainly labels).
+        Compares labels_hash when the stored row has one, which avoids
+        transferring the label array itself.
+        """
+        if labels_hash is not None:
+            return labels_hash != labels_fingerprint(new_data.get("labels"))
+        return frozenset(labels or ()) != frozenset(new_data.get("labels") or ())
 
-            existing = cursor.fetchone()
+    def _version_row(
+        self, email_data: Dict, valid_from: datetime, stored_message: str = None
+    ) -> tuple:
+        """
+        Build the column values for a new version of an email: the
+        _version_params values, with the body of an email fetched without one
+        taken from stored_message (the previous version's)
+        """
+        row = self._version_params(email_data, valid_from)
+        if row[6] is None:
+            row = row[:6] + (stored_message or "",) + row[7:]
+        return row
 
-            if existing:
-                has_changed = self._has_email_changed(existing, email_data)
+    def insert_emails_batch(self, emails: List[Dict]):
+        """Insert multiple emails with temporal tracking"""
+        print(f"\nProcessing {len(emails)} emails...")
+        self.batch_upsert(emails)
+
+    def batch_upsert(self, emails: List[Dict]):
+        """
+        Insert or version multiple emails in one transaction.
+        Falls back to per-email inserts if the batch fails, so one bad
+        email does not prevent the rest from being stored.
+        """
+        if not emails:
+            return
 
-                if has_changed:
+        # Last occurrence wins if the same id appears twice in one batch; an
+        # email without an id is reported and skipped, as a single insert would
+        latest = {}
+        for email in emails:
+            if "id" not in email:
+                print("Error inserting email: 'id'")
+                continue
+            latest[email["id"]] = email
+        if not latest:
+            return
+
+        with self._conn() as conn:
+            cursor = conn.cursor()
+            batch_failed = False
+
+            try:
+                now = self._now()
+
+                # Stored bodies are only read for emails fetched without one
+                bodyless = [
+                    email_id
+                    for email_id, email_data in latest.items()
+                    if email_data.get("message") is None
+                ]
+                cursor.execute(
+                    """
+                    SELECT email_id, labels_hash,
+                           CASE WHEN labels_hash IS NULL THEN labels END AS labels,
+                           CASE WHEN email_id = ANY(%s) THEN message END AS message
+                    FROM emails
+                    WHERE is_current = TRUE AND email_id = ANY(%s)
+                """,
+                    (bodyless, list(latest)),
+                )
+                # email_id -> (labels_hash, labels, message)
+                existing = {row[0]: row[1:] for row in cursor.fetchall()}
+
+                new_rows = []
+                changed_ids = []
+                unchanged_rows = []
+                for email_id, email_data in latest.items():
+                    if email_id not in existing:
+                        new_rows.append(self._version_row(email_data, now))
+                        continue
+                    labels_hash, labels, stored_message = existing[email_id]
+                    if self._has_email_changed(labels_hash, labels, email_data):
+                        changed_ids.append(email_id)
+                        new_rows.append(
+                            self._version_row(email_data, now, stored_message)
+                        )
+                    else:
+                        unchanged_rows.append(
+                            (
+                                email_id,
+                                email_data.get("thread_id", ""),
+                                email_data.get("from", ""),
+                                email_data.get("to", ""),
+                                email_data.get("subject", ""),
+                                email_data.get("message"),
+                                email_data.get("received_date"),
+                            )
+                        )
+
+                if changed_ids:
                     cursor.execute(
                         """
-                        UPDATE emails 
+                        UPDATE emails
                         SET valid_to = %s, is_current = FALSE
-                        WHERE email_id = %s AND is_current = TRUE
+                        WHERE is_current = TRUE AND email_id = ANY(%s)
                     """,
-                        (now, email_id),
+                        (now, changed_ids),
                     )
 
-                    self._insert_new_version(cursor, email_data, now)
-                else:
-                    cursor.execute(
+                if unchanged_rows:
+                    execute_values(
+                        cursor,
                         """
-                        UPDATE emails
-                        SET 
-                            thread_id = %s,
-                            from_email = %s,
-                            to_email = %s,
-                            subject = %s,
-                            message = %s,
-                            received_date = %s
-                        WHERE email_id = %s AND is_current = TRUE
-                        """,
-                        (
-                            email_data.get('thread_id'),
-                            email_data.get('from'),
-                            email_data.get('to'),
-                            email_data.get('subject'),
-                            email_data.get('message'),
-                            email_data.get('received_date'),
-                            email_id
-                        )
+                        UPDATE emails AS e
+                        SET
+                            thread_id = v.thread_id,
+                            from_email = v.from_email,
+                            to_email = v.to_email,
+                            subject = v.subject,
+                            message = COALESCE(v.message, e.message),
+                            received_date = v.received_date
+                        FROM (VALUES %s) AS v(email_id, thread_id, from_email,
+                                              to_email, subject, message, received_date)
+                        WHERE e.email_id = v.email_id AND e.is_current = TRUE
+                    """,
+                        unchanged_rows,
+                        template="(%s, %s, %s, %s, %s, %s::text, %s::timestamp)",
+                        page_size=BATCH_PAGE_SIZE,
                     )
-            else:
-                self._insert_new_version(cursor, email_data, now)
 
-            conn.commit()
+                if len(new_rows) >= COPY_MIN_ROWS:
+                    self._copy_versions(cursor, new_rows)
+                elif new_rows:
+                    execute_values(
+                        cursor,
+                        """
+                        INSERT INTO emails
+                        (email_id, valid_from, thread_id, from_email, to_email,
+                         subject, message, received_date, labels, labels_hash,
+                         valid_to, is_current)
+                        VALUES %s
+                    """,
+                        new_rows,
+                        template="(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NULL, TRUE)",
+                        page_size=BATCH_PAGE_SIZE,
+                    )
 
-        except Exception as e:
-            print(f"Error inserting email: {e}")
-            conn.rollback()
-        finally:
-            cursor.close()
-            conn.close()
+                conn.commit()
 
-    def _has_email_changed(self, existing: Dict, new_data: Dict) -> bool:
-        """Check if email data has changed (mainly labels)"""
-        existing_labels = set(
-            json.loads(existing["labels"]) if existing["labels"] else []
-        )
-        new_labels = set(new_data.get("labels", []))
-        return existing_labels != new_labels
+            except Exception as e:
+                print(f"Error in batch insert, retrying emails individually: {e}")
+                conn.rollback()
+                batch_failed = True
+            finally:
+                cursor.close()
 
-    def _insert_new_version(self, cursor, email_data: Dict, valid_from: datetime):
-        """Insert a new version of an email"""
+        if batch_failed:
+            for email in latest.values():
+                self.insert_or_update_email(email)
+
+    def _copy_versions(self, cursor, rows: List[tuple]):
+        """
+        Bulk-load new version rows (as built by _version_row) with COPY
+        through a staging table. received_date is staged in two columns so
+        naive and timezone-aware values convert exactly as they do in the
+        INSERT path.
+        """
+        # ON COMMIT DROP only fires at the outer commit, so a second COPY
+        # inside one transaction() would find the table still there
+        cursor.execute("DROP TABLE IF EXISTS emails_staging")
         cursor.execute(
             """
-            INSERT INTO emails 
-            (email_id, valid_from, thread_id, from_email, to_email, 
-             subject, message, received_date, labels, valid_to, is_current)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NULL, TRUE)
-        """,
-            (
-                email_data["id"],
-                valid_from,
-                email_data.get("thread_id", ""),
-                email_data.get("from", ""),
-                email_data.get("to", ""),
-                email_data.get("subject", ""),
-                email_data.get("message", ""),
-                email_data.get("received_date"),
-                json.dumps(email_data.get("labels", [])),
-            ),
+            CREATE TEMP TABLE emails_staging (
+                email_id VARCHAR(255),
+                valid_from TIMESTAMP,
+                thread_id VARCHAR(255),
+                from_email TEXT,
+                to_email TEXT,
+                subject TEXT,
+                message TEXT,
+                received_naive TIMESTAMP,
+                received_aware TIMESTAMPTZ,
+                labels TEXT[],
+                labels_hash BIGINT
+            ) ON COMMIT DROP
+        """
         )
 
-    def insert_emails_batch(self, emails: List[Dict]):
-        """Insert multiple emails with temporal tracking"""
-        print(f"\nProcessing {len(emails)} emails...")
-        for email in emails:
-            self.insert_or_update_email(email)
+        buffer = io.StringIO()
+        for row in rows:
+            received = row[7]
+            aware = received is not None and received.tzinfo is not None
+            staged = (
+                row[:7]
+                + (
+                    None if aware else received,
+                    received if aware else None,
+                )
+                + row[8:]
+            )
+            buffer.write(",".join(_csv_field(value) for value in staged))
+            buffer.write("\n")
+        buffer.seek(0)
+
+        cursor.copy_expert("COPY emails_staging FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(
+            """
+            INSERT INTO emails
+            (email_id, valid_from, thread_id, from_email, to_email,
+             subject, message, received_date, labels, labels_hash,
+             valid_to, is_current)
+            SELECT email_id, valid_from, thread_id, from_email, to_email,
+                   subject, message,
+                   COALESCE(received_naive, received_aware::timestamp),
+                   labels, labels_hash, NULL, TRUE
+            FROM emails_staging
+        """
+        )
 
     def get_all_emails(self) -> List[Dict]:
         """Retrieve all CURRENT emails (latest versions only)"""
-        conn = self.get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        return list(self.iter_all_emails())
 
-        try:
-            cursor.execute(
+    def iter_all_emails(self, itersize: int = 1000) -> Iterator[Dict]:
+        """
+        Stream all CURRENT emails using a server-side cursor.
+        Only `itersize` rows are held in memory at a time.
+        """
+        with self._conn() as conn:
+            cursor = conn.cursor(name="emails_stream", cursor_factory=RealDictCursor)
+            cursor.itersize = itersize
+
+            try:
+                cursor.execute(
+                    """
+                    SELECT * FROM emails 
+                    WHERE is_current = TRUE 
+                    ORDER BY received_date DESC
                 """
-                SELECT * FROM emails 
-                WHERE is_current = TRUE 
-                ORDER BY received_date DESC
-            """
-            )
-            rows = cursor.fetchall()
-
-            emails = []
-            for row in rows:
-                emails.append(
-                    {
-                        "id": row["email_id"],
-                        "thread_id": row["thread_id"],
-                        "from": row["from_email"],
-                        "to": row["to_email"],
-                        "subject": row["subject"],
-                        "message": row["message"],
-                        "received_date": row["received_date"],
-                        "labels": json.loads(row["labels"]) if row["labels"] else [],
-                    }
                 )
+                for row in cursor:
+                    yield self._row_to_email(row)
+
+            except Exception as e:
+                print(f"Error fetching emails: {e}")
+            finally:
+                cursor.close()
+
+    def _row_to_email(self, row: Dict) -> Dict:
+        """Convert an emails table row to the email dict used by the app"""
+        return {
+            "id": row["email_id"],
+            "thread_id": row["thread_id"],
+            "from": row["from_email"],
+            "to": row["to_email"],
+            "subject": row["subject"],
+            "message": row["message"],
+            "received_date": row["received_date"],
+            "labels": row["labels"] or [],
+        }
+
+    def match_current_emails(self, conditions: List[str], params: List) -> List[tuple]:
+        """
+        Evaluate SQL boolean conditions against every CURRENT email in one
+        scan. Returns (email_id, matched_0, matched_1, ...) for each email
+        matching at least one condition; params fill the conditions' %s
+        placeholders in order.
+        """
+        flags = [f"COALESCE({condition}, FALSE)" for condition in conditions]
+        columns = ", ".join(f"{flag} AS m{i}" for i, flag in enumerate(flags))
+        matched = " OR ".join(f"m{i}" for i in range(len(flags)))
+        with self._conn() as conn:
+            cursor = conn.cursor()
+
+            try:
+                cursor.execute(
+                    f"""
+                    SELECT * FROM (
+                        SELECT email_id, {columns}
+                        FROM emails
+                        WHERE is_current = TRUE
+                    ) AS evaluated
+                    WHERE {matched}
+                    ORDER BY email_id
+                """,
+                    params,
+                )
+                return cursor.fetchall()
 
-            return emails
-
-        except Exception as e:
-            print(f"Error fetching emails: {e}")
-            return []
-        finally:
-            cursor.close()
-            conn.close()
+            except Exception as e:
+                print(f"Error matching emails: {e}")
+                return []
+            finally:
+                cursor.close()
 
     def get_email_by_id(self, email_id: str) -> Optional[Dict]:
         """
         Retrieve a single current email by ID
         Only used for testing purposes.
         """
-        conn = self.get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-        try:
-            cursor.execute(
-                """
-                SELECT * FROM emails 
-                WHERE email_id = %s AND is_current = TRUE
-                AND valid_to IS NULL
-                ORDER BY received_date DESC NULLS LAST
-                LIMIT 1
-            """,
-                (email_id,),
-            )
-            row = cursor.fetchone()
-            if not row:
+        with self._conn() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+            try:
+                cursor.execute(
+                    """
+                    SELECT * FROM emails 
+                    WHERE email_id = %s AND is_current = TRUE
+                    AND valid_to IS NULL
+                    ORDER BY received_date DESC NULLS LAST
+                    LIMIT 1
+                """,
+                    (email_id,),
+                )
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                return self._row_to_email(row)
+            except Exception as e:
+                print(f"Error fetching email by id: {e}")
                 return None
-            return {
-                "id": row["email_id"],
-                "thread_id": row["thread_id"],
-                "from": row["from_email"],
-                "to": row["to_email"],
-                "subject": row["subject"],
-                "message": row["message"],
-                "received_date": row["received_date"],
-                "labels": json.loads(row["labels"]) if row["labels"] else [],
-            }
-        except Exception as e:
-            print(f"Error fetching email by id: {e}")
-            return None
-        finally:
-            cursor.close()
-            conn.close()
+            finally:
+                cursor.close()
 
     def count_emails(self) -> int:
         """Get count of current active unique emails"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        try:
-            cursor.execute(
+        with self._conn() as conn:
+            cursor = conn.cursor()
+
+            try:
+                cursor.execute(
+                    """
+                    SELECT COUNT(DISTINCT email_id) 
+                    FROM emails 
+                    WHERE is_current = TRUE
                 """
-                SELECT COUNT(DISTINCT email_id) 
-                FROM emails 
-                WHERE is_current = TRUE
-            """
-            )
-            count = cursor.fetchone()[0]
-            return count
-        except Exception as e:
-            print(f"Error counting emails: {e}")
-            return 0
-        finally:
-            cursor.close()
-            conn.close()
+                )
+                count = cursor.fetchone()[0]
+                return count
+            except Exception as e:
+                print(f"Error counting emails: {e}")
+                return 0
+            finally:
+                cursor.close()
 
     def get_stats(self) -> Dict:
         """Get database statistics"""
-        conn = self.get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-        try:
-            cursor.execute(
+        with self._conn() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+            try:
+                cursor.execute(
+                    """
+                    SELECT 
+                        COUNT(DISTINCT email_id) as unique_emails,
+                        COUNT(*) as total_versions,
+                        SUM(CASE WHEN is_current THEN 1 ELSE 0 END) as current_versions,
+                        SUM(CASE WHEN is_current THEN 0 ELSE 1 END) as historical_versions
+                    FROM emails
                 """
-                SELECT 
-                    COUNT(DISTINCT email_id) as unique_emails,
-                    COUNT(*) as total_versions,
-                    SUM(CASE WHEN is_current THEN 1 ELSE 0 END) as current_versions,
-                    SUM(CASE WHEN is_current THEN 0 ELSE 1 END) as historical_versions
-                FROM emails
-            """
-            )
+                )
 
-            stats = cursor.fetchone()
-            return dict(stats) if stats else {}
+                stats = cursor.fetchone()
+                return dict(stats) if stats else {}
 
-        except Exception as e:
-            print(f"Error fetching stats: {e}")
-            return {}
-        finally:
-            cursor.close()
-            conn.close()
+            except Exception as e:
+                print(f"Error fetching stats: {e}")
+                return {}
+            finally:
+                cursor.close()
 
     def get_email_history(self, email_id: str) -> List[Dict]:
         """
@@ -325,58 +748,126 @@ class EmailDatabase:
         Each entry includes: id, labels, is_current, valid_from.
         Used only for testing purposes.
         """
-        conn = self.get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        try:
-            cursor.execute(
-                """
-                SELECT email_id, labels, is_current, valid_from, valid_to
-                FROM emails
-                WHERE email_id = %s
-                ORDER BY valid_from ASC
-                """,
-                (email_id,),
-            )
-            rows = cursor.fetchall()
-            history: List[Dict] = []
-            for row in rows:
-                history.append(
-                    {
-                        "id": row["email_id"],
-                        "labels": json.loads(row["labels"]) if row["labels"] else [],
-                        "is_current": row["is_current"],
-                        "valid_from": row["valid_from"],
-                        "valid_to": row["valid_to"],
-                    }
+        with self._conn() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            try:
+                cursor.execute(
+                    """
+                    SELECT email_id, labels, is_current, valid_from, valid_to
+                    FROM emails
+                    WHERE email_id = %s
+                    ORDER BY valid_from ASC
+                    """,
+                    (email_id,),
                 )
-            return history
-        except Exception as e:
-            print(f"Error fetching email history: {e}")
-            return []
-        finally:
-            cursor.close()
-            conn.close()
+                rows = cursor.fetchall()
+                history: List[Dict] = []
+                for row in rows:
+                    history.append(
+                        {
+                            "id": row["email_id"],
+                            "labels": row["labels"] or [],
+                            "is_current": row["is_current"],
+                            "valid_from": row["valid_from"],
+                            "valid_to": row["valid_to"],
+                        }
+                    )
+                return history
+            except Exception as e:
+                print(f"Error fetching email history: {e}")
+                return []
+            finally:
+                cursor.close()
+
+    def get_current_labels(self, email_id: str) -> Optional[List[str]]:
+        """
+        Return the labels of an email's current version, or None if absent.
+        Used only for testing purposes.
+        """
+        with self._conn() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    """
+                    SELECT labels FROM emails
+                    WHERE email_id = %s AND is_current = TRUE
+                    """,
+                    (email_id,),
+                )
+                row = cursor.fetchone()
+                return (row[0] or []) if row else None
+            except Exception as e:
+                print(f"Error fetching current labels: {e}")
+                return None
+            finally:
+                cursor.close()
+
+    def get_message_length(self, email_id: str) -> Optional[int]:
+        """
+        Return the length of the current version's message body, measured
+        in the database so the body itself is not transferred.
+        Used only for testing purposes.
+        """
+        with self._conn() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    """
+                    SELECT length(message) FROM emails
+                    WHERE email_id = %s AND is_current = TRUE
+                    """,
+                    (email_id,),
+                )
+                row = cursor.fetchone()
+                return row[0] if row else None
+            except Exception as e:
+                print(f"Error fetching message length: {e}")
+                return None
+            finally:
+                cursor.close()
+
+    def count_distinct_valid_from(self, email_id: str) -> int:
+        """
+        Count the distinct valid_from timestamps among an email's versions.
+        Used only for testing purposes.
+        """
+        with self._conn() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    """
+                    SELECT COUNT(DISTINCT valid_from)
+                    FROM emails
+                    WHERE email_id = %s
+                    """,
+                    (email_id,),
+                )
+                return cursor.fetchone()[0]
+            except Exception as e:
+                print(f"Error counting email versions: {e}")
+                return 0
+            finally:
+                cursor.close()
 
     def get_stored_email_ids(self) -> List[str]:
         """
         Return list of email_ids that currently exist (is_current = TRUE).
         Only used for testing purposes.
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute(
-                """
-                SELECT DISTINCT email_id
-                FROM emails
-                WHERE is_current = TRUE
-                """
-            )
-            rows = cursor.fetchall()
-            return [row[0] for row in rows]
-        except Exception as e:
-            print(f"Error fetching stored email ids: {e}")
-            return []
-        finally:
-            cursor.close()
-            conn.close()
+        with self._conn() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    """
+                    SELECT DISTINCT email_id
+                    FROM emails
+                    WHERE is_current = TRUE
+                    """
+                )
+                rows = cursor.fetchall()
+                return [row[0] for row in rows]
+            except Exception as e:
+                print(f"Error fetching stored email ids: {e}")
+                return []
+            finally:
+                cursor.close()
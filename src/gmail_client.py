@@ -2,29 +2,96 @@
 Gmail API client for fetching and modifying emails
 Handles OAuth authentication and all Gmail API operations
 """
-import os.path
+import json
+import os
 import pickle
 import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from email.utils import parsedate_to_datetime
 from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from config import GMAIL_SCOPES, CREDENTIALS_FILE, TOKEN_FILE
+from googleapiclient.http import build_http
+from config import (
+    GMAIL_SCOPES,
+    CREDENTIALS_FILE,
+    TOKEN_FILE,
+    LEGACY_TOKEN_FILE,
+    MAX_FETCH_WORKERS,
+)
+
+
+# messages.batchModify accepts at most this many message IDs per request
+BATCH_MODIFY_LIMIT = 1000
+
+# messages.list returns at most this many messages per page
+LIST_PAGE_LIMIT = 500
+
+# Gmail accepts up to 100 calls per batch but starts rate limiting above 50
+FETCH_BATCH_SIZE = 50
+
+# Headers kept by _parse_message, requested alone when bodies are skipped
+METADATA_HEADERS = ["Subject", "From", "To", "Date"]
+WANTED_HEADERS = frozenset(METADATA_HEADERS)
+
+# System labels that cannot be added or removed through the API
+UNMODIFIABLE_LABELS = {"SENT", "DRAFT", "CHAT"}
 
 
 class GmailClient:
-    def __init__(self):
-        self.service = None
+    def __init__(self, needs_body=True):
+        self.creds = None
+        self.needs_body = needs_body  # False fetches headers only
+        self._local = threading.local()
+        self._label_cache = None  # label ID -> label resource
+        self._label_name_to_id = {}
+        self._label_lock = threading.Lock()
         self.authenticate()
 
+    @property
+    def service(self):
+        """Gmail service for the calling thread (httplib2 is not thread-safe)"""
+        if getattr(self._local, "service", None) is None:
+            self._local.service = self._build_service(self.creds)
+        return self._local.service
+
+    @staticmethod
+    def _build_service(creds):
+        """
+        Build a Gmail service from the discovery document bundled with
+        google-api-python-client, avoiding a discovery HTTP request
+
+        The service owns one authorized HTTP object, so every request made
+        through it reuses the same kept-alive connection to Gmail
+        """
+        http = AuthorizedHttp(creds, http=build_http())
+        return build(
+            "gmail",
+            "v1",
+            http=http,
+            static_discovery=True,
+            cache_discovery=False,
+        )
+
     def authenticate(self):
         """Authenticate with Gmail API using OAuth2"""
         creds = None
 
         if os.path.exists(TOKEN_FILE):
-            with open(TOKEN_FILE, "rb") as token:
+            with open(TOKEN_FILE, "r") as token:
+                creds = Credentials.from_authorized_user_info(
+                    json.load(token), GMAIL_SCOPES
+                )
+        elif os.path.exists(LEGACY_TOKEN_FILE):
+            # One-time migration from the old pickled token
+            with open(LEGACY_TOKEN_FILE, "rb") as token:
                 creds = pickle.load(token)
+            self._save_token(creds)
+            os.remove(LEGACY_TOKEN_FILE)
 
         if not creds or not creds.valid:
             if creds and creds.expired and creds.refresh_token:
@@ -35,85 +102,147 @@ class GmailClient:
                 )
                 creds = flow.run_local_server(port=0)
 
-            with open(TOKEN_FILE, "wb") as token:
-                pickle.dump(creds, token)
+            self._save_token(creds)
 
-        self.service = build("gmail", "v1", credentials=creds)
+        self.creds = creds
+        self._local.service = self._build_service(creds)
         print("Gmail authentication successful")
 
+    @staticmethod
+    def _save_token(creds):
+        """Store credentials as JSON so later runs can skip the OAuth flow"""
+        with open(TOKEN_FILE, "w") as token:
+            token.write(creds.to_json())
+
     def fetch_emails(self, max_results=50):
         """Fetch emails from Gmail inbox"""
         try:
             print(f"Fetching up to {max_results} emails...")
-            results = (
-                self.service.users()
-                .messages()
-                .list(userId="me", labelIds=["INBOX"], maxResults=max_results)
-                .execute()
-            )
-
-            messages = results.get("messages", [])
+            message_ids = self._list_message_ids(max_results)
 
-            if not messages:
+            if not message_ids:
                 print("No messages found.")
                 return []
 
-            emails = []
-            for i, msg in enumerate(messages, 1):
-                print(f"  Fetching email {i}/{len(messages)}...", end="\r")
-                email_data = self.get_email_details(msg["id"])
-                if email_data:
-                    emails.append(email_data)
+            chunks = [
+                message_ids[start : start + FETCH_BATCH_SIZE]
+                for start in range(0, len(message_ids), FETCH_BATCH_SIZE)
+            ]
 
-            print(f"\nSuccessfully fetched {len(emails)} emails")
+            # Batches are independent; each worker thread has its own service
+            details = {}
+            workers = min(MAX_FETCH_WORKERS, len(chunks))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for batch_details in executor.map(self._fetch_batch, chunks):
+                    details.update(batch_details)
+
+            emails = [details[i] for i in message_ids if i in details]
+
+            print(f"Successfully fetched {len(emails)} emails")
             return emails
 
         except HttpError as error:
             print(f"Error fetching emails: {error}")
             return []
 
-    def get_email_details(self, msg_id):
-        """Get detailed information about a specific email"""
-        try:
-            message = (
+    def _list_message_ids(self, max_results):
+        """List up to max_results inbox message IDs, following result pages"""
+        message_ids = []
+        page_token = None
+        while len(message_ids) < max_results:
+            results = (
                 self.service.users()
                 .messages()
-                .get(userId="me", id=msg_id, format="full")
+                .list(
+                    userId="me",
+                    labelIds=["INBOX"],
+                    maxResults=min(LIST_PAGE_LIMIT, max_results - len(message_ids)),
+                    pageToken=page_token,
+                    fields="messages/id,nextPageToken",
+                )
                 .execute()
             )
+            message_ids.extend(msg["id"] for msg in results.get("messages", []))
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                break
+        return message_ids
+
+    def _fetch_batch(self, message_ids):
+        """Fetch and parse messages in one batch request, keyed by message ID"""
+        details = {}
+
+        def collect(request_id, response, exception):
+            if exception is not None:
+                print(f"Error fetching email {request_id}: {exception}")
+                return
+            details[request_id] = self._parse_message(response)
+
+        batch = self.service.new_batch_http_request(callback=collect)
+        for msg_id in message_ids:
+            batch.add(self._get_request(msg_id), request_id=msg_id)
+        batch.execute()
+        return details
 
-            headers = message["payload"]["headers"]
-            header_dict = {h["name"]: h["value"] for h in headers}
-
-            subject = header_dict.get("Subject", "")
-            from_email = header_dict.get("From", "")
-            to_email = header_dict.get("To", "")
-            date_str = header_dict.get("Date", "")
-
-            received_date = None
-            if date_str:
-                try:
-                    received_date = parsedate_to_datetime(date_str)
-                except:
-                    received_date = None
-
-            body = self._get_email_body(message["payload"])
-
-            return {
-                "id": msg_id,
-                "thread_id": message["threadId"],
-                "from": from_email,
-                "to": to_email,
-                "subject": subject,
-                "message": body,
-                "received_date": received_date,
-                "labels": message.get("labelIds", []),
-            }
+    def get_email_details(self, msg_id):
+        """Get detailed information about a specific email"""
+        try:
+            message = self._get_request(msg_id).execute()
+            return self._parse_message(message)
 
         except HttpError as error:
             print(f"Error fetching email {msg_id}: {error}")
             return None
 
+    def _get_request(self, msg_id):
+        """Build the messages.get request, skipping the body when not needed"""
+        messages = self.service.users().messages()
+        if self.needs_body:
+            return messages.get(userId="me", id=msg_id, format="full")
+        return messages.get(
+            userId="me",
+            id=msg_id,
+            format="metadata",
+            metadataHeaders=METADATA_HEADERS,
+        )
+
+    def _parse_message(self, message):
+        """Convert a Gmail API message resource into an email dict"""
+        header_dict = {}
+        for header in message["payload"]["headers"]:
+            if header["name"] in WANTED_HEADERS:
+                # Duplicates are malformed; keep the first, as mail clients do
+                header_dict.setdefault(header["name"], header["value"])
+                if len(header_dict) == len(WANTED_HEADERS):
+                    break
+
+        subject = header_dict.get("Subject", "")
+        from_email = header_dict.get("From", "")
+        to_email = header_dict.get("To", "")
+        date_str = header_dict.get("Date", "")
+
+        received_date = None
+        if date_str:
+            try:
+                received_date = parsedate_to_datetime(date_str)
+            except:
+                received_date = None
+
+        email = {
+            "id": message["id"],
+            "thread_id": message["threadId"],
+            "from": from_email,
+            "to": to_email,
+            "subject": subject,
+            "received_date": received_date,
+            "labels": message.get("labelIds", []),
+        }
+        # Without a body the key is left out, so the database keeps the
+        # body it already has for the email
+        if self.needs_body:
+            email["message"] = self._get_email_body(message["payload"])
+        return email
+
     def _get_email_body(self, payload):
         """Extract email body from payload"""
         body = ""
@@ -155,6 +284,52 @@ class GmailClient:
             print(f"Error marking as unread: {error}")
             return False
 
+    def batch_modify(self, message_ids, add_labels, remove_labels) -> list:
+        """
+        Apply the same label change to many messages via messages.batchModify
+        Labels may be given by name or ID; missing labels to add are created
+        and unknown labels to remove are skipped
+
+        Returns:
+            IDs of the messages that were changed; a failed request only
+            loses its own chunk of up to BATCH_MODIFY_LIMIT IDs
+        """
+        try:
+            add_ids = [self._get_or_create_label(name) for name in add_labels]
+            if None in add_ids:
+                return []
+
+            if any(self._label_id(name) is None for name in remove_labels):
+                self._load_labels(force=True)
+            remove_ids = [self._label_id(name) for name in remove_labels]
+            remove_ids = [
+                label_id
+                for label_id in remove_ids
+                if label_id is not None and label_id not in UNMODIFIABLE_LABELS
+            ]
+        except Exception as e:
+            print(f"Error modifying messages: {e}")
+            return []
+
+        modified = []
+        for start in range(0, len(message_ids), BATCH_MODIFY_LIMIT):
+            chunk = message_ids[start : start + BATCH_MODIFY_LIMIT]
+            try:
+                self.service.users().messages().batchModify(
+                    userId="me",
+                    body={
+                        "ids": chunk,
+                        "addLabelIds": add_ids,
+                        "removeLabelIds": remove_ids,
+                    },
+                ).execute()
+            except Exception as e:
+                print(f"Error modifying messages: {e}")
+                continue
+            modified.extend(chunk)
+
+        return modified
+
     def move_message(self, message_id: str, destination_label: str) -> bool:
         """
         Move message to specified label (matches traditional email folder behavior)
@@ -172,22 +347,7 @@ class GmailClient:
             )
 
             current_labels = msg.get("labelIds", [])
-
-            all_labels = self.service.users().labels().list(userId="me").execute()
-            label_info = {l["id"]: l for l in all_labels.get("labels", [])}
-
-            labels_to_remove = []
-
-            location_labels = ["INBOX", "TRASH", "SPAM"]
-
-            for label_id in current_labels:
-                label = label_info.get(label_id, {})
-
-                if label_id in location_labels:
-                    labels_to_remove.append(label_id)
-
-                elif label.get("type") == "user" and label_id != destination_id:
-                    labels_to_remove.append(label_id)
+            labels_to_remove = self._labels_to_remove(current_labels, destination_id)
 
             self.service.users().messages().modify(
                 userId="me",
@@ -204,27 +364,78 @@ class GmailClient:
             print(f"✗ Error moving message: {e}")
             return False
 
+    def _labels_to_remove(self, current_labels, destination_id):
+        """Labels a move takes off: locations and other user labels"""
+        label_info = self._load_labels()
+        if any(label_id not in label_info for label_id in current_labels):
+            label_info = self._load_labels(force=True)
+
+        labels_to_remove = []
+
+        location_labels = ["INBOX", "TRASH", "SPAM"]
+
+        for label_id in current_labels:
+            label = label_info.get(label_id, {})
+
+            if label_id in location_labels:
+                labels_to_remove.append(label_id)
+
+            elif label.get("type") == "user" and label_id != destination_id:
+                labels_to_remove.append(label_id)
+
+        return labels_to_remove
+
+    def _load_labels(self, force=False):
+        """
+        Return the label ID -> label mapping, listing labels from Gmail only
+        on first use or when force is set
+        """
+        with self._label_lock:
+            if self._label_cache is None or force:
+                results = self.service.users().labels().list(userId="me").execute()
+                labels = results.get("labels", [])
+                self._label_cache = {label["id"]: label for label in labels}
+                self._label_name_to_id = {
+                    label["name"]: label["id"] for label in labels
+                }
+            return self._label_cache
+
+    def _label_id(self, label):
+        """Resolve a cached label name or ID to its ID, or None if unknown"""
+        labels = self._load_labels()
+        if label in labels:
+            return label
+        return self._label_name_to_id.get(label)
+
     def _get_or_create_label(self, label_name):
         """Get existing label or create new one"""
         try:
-            results = self.service.users().labels().list(userId="me").execute()
-            labels = results.get("labels", [])
-
-            for label in labels:
-                if label["name"] == label_name:
-                    return label["id"]
-
-            label_object = {
-                "name": label_name,
-                "labelListVisibility": "labelShow",
-                "messageListVisibility": "show",
-            }
-            created_label = (
-                self.service.users()
-                .labels()
-                .create(userId="me", body=label_object)
-                .execute()
-            )
+            label_id = self._label_id(label_name)
+            if label_id is None:
+                # The label may have been created since the cache was filled
+                self._load_labels(force=True)
+                label_id = self._label_id(label_name)
+            if label_id is not None:
+                return label_id
+
+            with self._label_lock:
+                # Another thread may have created it while we waited
+                if label_name in self._label_name_to_id:
+                    return self._label_name_to_id[label_name]
+
+                label_object = {
+                    "name": label_name,
+                    "labelListVisibility": "labelShow",
+                    "messageListVisibility": "show",
+                }
+                created_label = (
+                    self.service.users()
+                    .labels()
+                    .create(userId="me", body=label_object)
+                    .execute()
+                )
+                self._label_cache[created_label["id"]] = created_label
+                self._label_name_to_id[label_name] = created_label["id"]
 
             print(f"Created new label: {label_name}")
             return created_label["id"]
@@ -2,34 +2,260 @@
 Rule engine for evaluating email rules
 Automatically validates rules before loading
 """
+import copy
+import hashlib
 import json
-from datetime import datetime, timedelta
+import operator
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from typing import List, Dict, Any
-from dateutil import parser as date_parser
+from email.utils import parsedate_to_datetime
 from src.rule_validator import RuleValidator, RuleValidationError
 
 
+# Condition checkers: check(email_value, prepared_value) -> bool
+# Module-level functions so compiled rules stay picklable for the rule cache.
+# String checkers receive the field already lowercased and stripped (see
+# _prepare_email); date checkers receive the raw received_date.
+
+
+def _normalize(email_value: Any) -> str:
+    if email_value is None:
+        return ""
+    return str(email_value).lower().strip()
+
+
+def _prepare_email(email: Dict, fields) -> Dict:
+    """Read each field once, normalizing text fields for the string checkers"""
+    return {
+        field: (
+            email.get(field, "")
+            if field == "received_date"
+            else _normalize(email.get(field, ""))
+        )
+        for field in fields
+    }
+
+
+def _matches(compiled, view: Dict) -> bool:
+    """Evaluate a compiled rule against a prepared email"""
+    combine, conditions = compiled
+    if combine is None:
+        return False
+    return combine(check(view[field], value) for field, check, value in conditions)
+
+
+def _never(email_value: Any, value: Any) -> bool:
+    return False
+
+
+def _does_not_contain(text: str, value: str) -> bool:
+    return value not in text
+
+
+def _one_of(text: str, values: frozenset) -> bool:
+    """Several 'equals' conditions of an 'any' rule on one field, merged"""
+    return text in values
+
+
+class _AgeThreshold:
+    """
+    The cut-off (now - age) for a date condition, kept for naive and aware
+    email dates and refreshed by RuleEngine.set_now instead of per email
+    """
+
+    def __init__(self, age: timedelta):
+        self.age = age
+        self.refresh(datetime.now(timezone.utc))
+
+    def refresh(self, now: datetime):
+        self.aware = now - self.age
+        self.naive = now.astimezone().replace(tzinfo=None) - self.age
+
+    def for_date(self, email_date: datetime) -> datetime:
+        return self.aware if email_date.tzinfo is not None else self.naive
+
+
+def _to_datetime(email_date: Any) -> datetime:
+    """Dates arrive as datetimes; accept ISO or RFC 2822 strings as a fallback"""
+    if not isinstance(email_date, str):
+        return email_date
+    return _parse_date(email_date)
+
+
+@lru_cache(maxsize=4096)
+def _parse_date(text: str) -> datetime:
+    """Parse a date string; emails of one batch often share a Date header"""
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        return parsedate_to_datetime(text)
+
+
+def _less_than(email_date: Any, threshold: _AgeThreshold) -> bool:
+    """Email is newer than the threshold age"""
+    if not email_date:
+        return False
+    try:
+        email_date = _to_datetime(email_date)
+        return email_date > threshold.for_date(email_date)
+    except Exception as e:
+        print(f"Error evaluating date: {e}")
+        return False
+
+
+def _greater_than(email_date: Any, threshold: _AgeThreshold) -> bool:
+    """Email is older than the threshold age"""
+    if not email_date:
+        return False
+    try:
+        email_date = _to_datetime(email_date)
+        return email_date < threshold.for_date(email_date)
+    except Exception as e:
+        print(f"Error evaluating date: {e}")
+        return False
+
+
+# operator builtins where one exists, avoiding a Python call frame per check
+STRING_CHECKERS = {
+    "contains": operator.contains,
+    "does_not_contain": _does_not_contain,
+    "equals": operator.eq,
+    "does_not_equal": operator.ne,
+}
+
+DATE_CHECKERS = {
+    "less_than": _less_than,
+    "greater_than": _greater_than,
+}
+
+# Days per unit for received_date conditions
+DATE_UNITS = {"days": 1, "months": 30}
+
+RULE_PREDICATES = {"all": all, "any": any}
+
+# SQL for evaluate_rules_in_db: emails table column per field, and per check a
+# boolean test over the normalized text or the raw date column (one %s each)
+SQL_COLUMNS = {
+    "from": "from_email",
+    "to": "to_email",
+    "subject": "subject",
+    "message": "message",
+    "received_date": "received_date",
+}
+# Every character str.strip() removes, so btrim trims what _normalize does
+_STRIP_CHARS = (
+    "\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680"
+    + "".join(map(chr, range(0x2000, 0x200B)))
+    + "\u2028\u2029\u202f\u205f\u3000"
+)
+_SQL_STRIP_CHARS = "E'%s'" % "".join(f"\\u{ord(c):04x}" for c in _STRIP_CHARS)
+SQL_TEXT = "lower(btrim(COALESCE({column}, ''), %s))" % _SQL_STRIP_CHARS
+SQL_TESTS = {
+    operator.contains: "strpos({text}, %s) > 0",
+    _does_not_contain: "strpos({text}, %s) = 0",
+    operator.eq: "{text} = %s",
+    operator.ne: "{text} <> %s",
+    _one_of: "{text} = ANY(%s)",
+    _less_than: "{column} > %s",
+    _greater_than: "{column} < %s",
+}
+SQL_COMBINE = {all: (" AND ", "TRUE"), any: (" OR ", "FALSE")}
+
+# Relative cost of a check, so cheap conditions run first and all/any stop early
+CHECK_COSTS = {
+    _never: 0,
+    operator.eq: 1,
+    operator.ne: 1,
+    _one_of: 1,
+    operator.contains: 2,
+    _does_not_contain: 2,
+    _less_than: 4,
+    _greater_than: 4,
+}
+
+
+# Rules that passed validation, keyed by the SHA-256 of the file contents, so
+# identical rule sets share one validation: digest -> (rules, warnings)
+_VALIDATED_RULES = {}
+
+
 class RuleEngine:
-    def __init__(self, rules_file="rules.json"):
+    # Bump when the pickled engine layout changes (invalidates rule caches)
+    CACHE_VERSION = 14
+
+    def __init__(self, rules_file="rules.json", verbose=True):
         """Initialize rule engine with validation"""
-        # Validate rules before loading
-        self._validate_rules(rules_file)
-        self.rules = self.load_rules(rules_file)
+        self.verbose = verbose  # print each matched rule
+        self.warnings = []  # validation warnings, kept to re-print from cache
+        # Validate rules before loading (skipped for already validated contents)
+        self.rules = self._load_validated_rules(rules_file)
+        self._thresholds = {}  # age in days -> shared _AgeThreshold
+        for rule in self.rules:
+            rule["_compiled"] = self._compile_rule(rule)
+            rule["_sql"] = self._compile_rule_sql(rule["_compiled"])
+        self._build_index()
+        # Every field some condition reads, prepared once per email
+        self._fields = {
+            cond["field"] for rule in self.rules for cond in rule["conditions"]
+        }
+        # Emails only need their body fetched when a rule looks at it
+        self.needs_body = any(
+            cond["field"] == "message"
+            for rule in self.rules
+            for cond in rule["conditions"]
+        )
         print(f"Loaded {len(self.rules)} validated rules")
 
-    def _validate_rules(self, rules_file: str):
-        """Validate rules file - integrated validation"""
+    def _load_validated_rules(self, rules_file: str) -> List[Dict]:
+        """
+        Validate and load rules, reusing the result of an earlier engine
+        whose rules file had exactly the same contents
+        """
+        try:
+            with open(rules_file, "rb") as f:
+                raw = f.read()
+        except OSError:
+            raw = None
+        digest = hashlib.sha256(raw).digest() if raw is not None else None
+
+        cached = _VALIDATED_RULES.get(digest)
+        if cached:
+            rules, warnings = cached
+            self.warnings = list(warnings)
+            self._print_warnings(warnings)
+            return copy.deepcopy(rules)
+
+        # Parse the bytes already read once for both validation and loading;
+        # a missing file or bad JSON goes through the validator's own reporting
+        try:
+            data = json.loads(raw)
+        except (TypeError, ValueError):
+            data = None
+        if isinstance(data, dict):
+            validator = self._validate_rules(rules_file, data)
+            rules = data.get("rules", [])
+        else:
+            validator = self._validate_rules(rules_file)
+            rules = self.load_rules(rules_file)
+        self.warnings = list(validator.warnings)
+        if digest and not validator.errors:
+            _VALIDATED_RULES[digest] = (copy.deepcopy(rules), list(validator.warnings))
+        return rules
+
+    def _validate_rules(self, rules_file: str, data: Dict = None) -> RuleValidator:
+        """Validate rules file (or its already-parsed data) - integrated validation"""
         print(f"Validating rules file: {rules_file}")
         validator = RuleValidator()
 
         try:
-            validator.validate_rules_file(rules_file)
-
-            if validator.warnings:
-                print(f"\nValidation warnings:")
-                for warning in validator.warnings:
-                    print(f"  {warning}")
-                print()
+            if data is None:
+                validator.validate_rules_file(rules_file)
+            else:
+                validator.validate_rules(data)
+            self._print_warnings(validator.warnings)
+            return validator
 
         except RuleValidationError as e:
             print(f"\nRule validation failed:")
@@ -37,6 +263,14 @@ class RuleEngine:
             print("\nFix the errors above and try again.")
             raise
 
+    @staticmethod
+    def _print_warnings(warnings: List[str]):
+        if warnings:
+            print(f"\nValidation warnings:")
+            for warning in warnings:
+                print(f"  {warning}")
+            print()
+
     def load_rules(self, rules_file: str) -> List[Dict]:
         """Load rules from JSON file (already validated)"""
         try:
@@ -49,102 +283,273 @@ class RuleEngine:
 
     def evaluate_rules(self, email: Dict) -> List[Dict]:
         """Evaluate all rules against an email"""
+        if not self.rules:
+            return []
         actions_to_execute = []
+        view = _prepare_email(email, self._fields)
 
         for rule in self.rules:
-            if self.evaluate_rule(rule, email):
-                print(f"Rule matched: '{rule['name']}'")
+            if _matches(rule["_compiled"], view):
+                if self.verbose:
+                    print(f"Rule matched: '{rule['name']}'")
                 actions_to_execute.extend(rule["actions"])
 
         return actions_to_execute
 
-    def evaluate_rule(self, rule: Dict, email: Dict) -> bool:
-        """Evaluate a single rule"""
-        predicate = rule["predicate"].lower()
+    def _build_index(self):
+        """
+        Index rules by the field values their 'equals' conditions require
+        and the substrings their 'contains' conditions require, so
+        evaluate_rules_indexed can skip rules that cannot match
+        """
+        self._equals_index = defaultdict(list)  # (field, value) -> rule positions
+        contains_index = defaultdict(lambda: defaultdict(list))
+        self._scan_rules = []  # positions of rules that are always evaluated
+
+        for position, rule in enumerate(self.rules):
+            keys = self._index_keys(rule)
+            if keys is None:
+                self._scan_rules.append(position)
+                continue
+            for predicate, field, value in keys:
+                if predicate == "equals":
+                    self._equals_index[(field, value)].append(position)
+                else:
+                    contains_index[field][value].append(position)
+
+        # field -> [(substring, rule positions)], each substring tested once
+        self._contains_index = {
+            field: list(values.items()) for field, values in contains_index.items()
+        }
+        self._indexed_fields = {field for field, _ in self._equals_index}
+        self._indexed_fields.update(self._contains_index)
+
+    def _index_keys(self, rule: Dict):
+        """
+        Return (predicate, field, value) keys of which a matching email must
+        satisfy at least one, or None if the rule has to be evaluated for
+        every email
+        """
         conditions = rule["conditions"]
+        keys = [
+            (cond["predicate"], cond["field"], str(cond["value"]).lower().strip())
+            for cond in conditions
+            if cond["predicate"] in ("equals", "contains")
+            and cond["field"] != "received_date"
+            and cond["value"] is not None
+            and str(cond["value"]).strip()
+        ]
 
-        results = [self.evaluate_condition(cond, email) for cond in conditions]
+        predicate = rule["predicate"].lower()
+        if predicate == "all" and keys:
+            # Any one required condition is enough to rule the email out;
+            # an exact value is the cheapest to look up
+            keys.sort(key=lambda key: key[0] != "equals")
+            return keys[:1]
+        if predicate == "any" and keys and len(keys) == len(conditions):
+            return keys
+        return None
 
-        if predicate == "all":
-            return all(results)
-        elif predicate == "any":
-            return any(results)
-        return False
+    def evaluate_rules_indexed(self, email: Dict) -> List[Dict]:
+        """
+        Evaluate all rules against an email, using the equals and contains
+        indexes to skip rules that cannot match. Returns the same actions, in
+        the same order, as evaluate_rules.
+        """
+        return self._evaluate_indexed(email, {})
 
-    def evaluate_condition(self, condition: Dict, email: Dict) -> bool:
-        """Evaluate a single condition"""
-        field = condition["field"]
-        predicate = condition["predicate"]
-        value = condition["value"]
+    def evaluate_rules_batch(self, emails: List[Dict]) -> List[List[Dict]]:
+        """
+        Evaluate all rules against a batch of emails, returning each email's
+        actions as evaluate_rules_indexed would. Index lookups are shared by
+        emails with the same header values (senders and subjects repeat a lot)
+        """
+        if not self.rules:
+            return [[] for _ in emails]
+        hits = {}  # (field, text) -> rule positions the indexes admit
+        return [self._evaluate_indexed(email, hits) for email in emails]
 
-        email_value = email.get(field, "")
+    def _index_hits(self, field: str, text: str):
+        """Positions of indexed rules an email with this field text may match"""
+        positions = list(self._equals_index.get((field, text), ()))
+        for substring, rule_positions in self._contains_index.get(field, ()):
+            if substring in text:
+                positions.extend(rule_positions)
+        return positions
 
-        if field == "received_date":
-            unit = condition.get("unit", "days")
-            return self._evaluate_date_condition(email_value, predicate, value, unit)
-        else:
-            return self._evaluate_string_condition(email_value, predicate, value)
-
-    def _evaluate_string_condition(
-        self, email_value: str, predicate: str, condition_value: str
-    ) -> bool:
-        """Evaluate string-based conditions"""
-        if email_value is None:
-            email_value = ""
-
-        if condition_value is None:
-            return False
-
-        raw_email_value = str(email_value).lower()
-        email_value = raw_email_value.strip()
-        condition_value = str(condition_value).lower().strip()
-
-        if condition_value == "":
-            return False
-        if predicate == "contains":
-            return condition_value in email_value
-        elif predicate == "does_not_contain":
-            return condition_value not in email_value
-        elif predicate == "equals":
-            return email_value == condition_value
-        elif predicate == "does_not_equal":
-            return email_value != condition_value
-        return False
+    def _evaluate_indexed(self, email: Dict, hits: Dict) -> List[Dict]:
+        view = _prepare_email(email, self._fields)
+        candidates = set(self._scan_rules)
+        for field in self._indexed_fields:
+            text = view[field]
+            if field == "message":
+                # Bodies rarely repeat and are costly to hash; don't memoize
+                candidates.update(self._index_hits(field, text))
+                continue
+            key = (field, text)
+            if key not in hits:
+                hits[key] = self._index_hits(field, text)
+            candidates.update(hits[key])
 
-    def _evaluate_date_condition(
-        self, email_date: Any, predicate: str, value: str, unit: str
-    ) -> bool:
-        """Evaluate date-based conditions"""
-        if not email_date:
-            return False
+        actions_to_execute = []
 
-        try:
-            if isinstance(email_date, str):
-                email_date = date_parser.parse(email_date)
+        for position in sorted(candidates):
+            rule = self.rules[position]
+            if _matches(rule["_compiled"], view):
+                if self.verbose:
+                    print(f"Rule matched: '{rule['name']}'")
+                actions_to_execute.extend(rule["actions"])
 
-            now = datetime.now()
-            if email_date.tzinfo is not None:
-                from datetime import timezone
+        return actions_to_execute
 
-                now = datetime.now(timezone.utc)
-                email_date = email_date.astimezone(timezone.utc)
+    def evaluate_rules_in_db(self, db) -> Dict[str, List[Dict]]:
+        """
+        Evaluate all rules inside the database in a single scan of the
+        current emails. Returns {email_id: actions} for every email that
+        matches a rule, with actions in the order evaluate_rules gives.
+        Text is lowercased by the database, so case folding beyond ASCII
+        follows its locale rather than Python's; surrounding whitespace is
+        trimmed with the same (Unicode) character set as str.strip().
+        """
+        if not self.rules:
+            return {}
+        conditions, params = [], []
+        for rule in self.rules:
+            where, values = rule["_sql"]
+            conditions.append(where)
+            params.extend(
+                value.naive if isinstance(value, _AgeThreshold) else value
+                for value in values
+            )
 
-            value_int = int(value)
+        matches = {}
+        for email_id, *flags in db.match_current_emails(conditions, params):
+            actions_to_execute = []
+            for rule, matched in zip(self.rules, flags):
+                if matched:
+                    if self.verbose:
+                        print(f"Rule matched: '{rule['name']}'")
+                    actions_to_execute.extend(rule["actions"])
+            matches[email_id] = actions_to_execute
+        return matches
 
-            if unit == "days":
-                threshold = now - timedelta(days=value_int)
-            elif unit == "months":
-                threshold = now - timedelta(days=value_int * 30)
-            else:
-                return False
+    def set_now(self, now: datetime = None):
+        """
+        Re-read the clock used by date conditions; call once before each
+        batch of emails (timezone-aware now, defaults to the current time)
+        """
+        now = now or datetime.now(timezone.utc)
+        for threshold in self._thresholds.values():
+            threshold.refresh(now)
 
-            if predicate == "less_than":
-                return email_date > threshold
-            elif predicate == "greater_than":
-                return email_date < threshold
+    def __setstate__(self, state):
+        # An engine loaded from the rule cache must not use a stale clock
+        self.__dict__.update(state)
+        self.set_now()
 
-        except Exception as e:
-            print(f"Error evaluating date: {e}")
-            return False
+    def _compile_rule(self, rule: Dict):
+        """
+        Compile a rule into (combine, conditions); combine is all/any (or None
+        for an unknown predicate) and conditions is a tuple of
+        (field, check, prepared_value) with constant work done up front,
+        cheapest first (the long message body counts as slightly dearer)
+        """
+        combine = RULE_PREDICATES.get(rule["predicate"].lower())
+        conditions = [self._compile_condition(c) for c in rule["conditions"]]
+        if combine is any:
+            conditions = self._merge_equals(conditions)
+        conditions.sort(key=lambda c: self._condition_order(combine, c))
+        return combine, tuple(conditions)
 
-        return False
+    @staticmethod
+    def _condition_order(combine, condition):
+        """
+        Sort key: cost first, then for substring checks the likeliest to
+        decide the rule - for 'all' the longest needle (rarest, most likely
+        to fail), for 'any' the shortest (most likely to hit)
+        """
+        field, check, value = condition
+        cost = CHECK_COSTS[check] + (field == "message")
+        if check is operator.contains:
+            return cost, len(value) if combine is any else -len(value)
+        return cost, 0
+
+    @staticmethod
+    def _merge_equals(conditions: List) -> List:
+        """
+        Collapse the 'equals' conditions of an 'any' rule that share a field
+        into one set lookup (an allowlist of senders becomes one check)
+        """
+        values = defaultdict(set)
+        for field, check, value in conditions:
+            if check is operator.eq:
+                values[field].add(value)
+        merged = []
+        for field, check, value in conditions:
+            if check is not operator.eq or len(values[field]) == 1:
+                merged.append((field, check, value))
+            elif values[field]:
+                merged.append((field, _one_of, frozenset(values[field])))
+                values[field] = ()  # later duplicates are covered by the set
+        return merged
+
+    @staticmethod
+    def _compile_rule_sql(compiled):
+        """
+        Translate a compiled rule into (where, params) for evaluate_rules_in_db;
+        date thresholds stay _AgeThreshold objects so set_now still applies
+        """
+        combine, conditions = compiled
+        if combine is None:
+            return "FALSE", ()
+        joiner, empty = SQL_COMBINE[combine]
+        tests, params = [], []
+        for field, check, value in conditions:
+            if check is _never:
+                tests.append("FALSE")
+                continue
+            column = SQL_COLUMNS[field]
+            test = SQL_TESTS[check].format(
+                column=column, text=SQL_TEXT.format(column=column)
+            )
+            tests.append(f"({test})")
+            params.append(sorted(value) if check is _one_of else value)
+        return joiner.join(tests) or empty, tuple(params)
+
+    def _compile_condition(self, condition: Dict):
+        """Compile a single condition into (field, check, prepared_value)"""
+        field = condition["field"]
+        predicate = condition["predicate"]
+        value = condition["value"]
+
+        if field == "received_date":
+            unit = condition.get("unit", "days")
+            check = DATE_CHECKERS.get(predicate)
+            try:
+                days = int(value) * DATE_UNITS[unit]
+            except (KeyError, TypeError, ValueError):
+                return field, _never, None
+            if check is None:
+                return field, _never, None
+            if days not in self._thresholds:
+                self._thresholds[days] = _AgeThreshold(timedelta(days=days))
+            return field, check, self._thresholds[days]
+
+        if value is None:
+            return field, _never, None
+        value = str(value).lower().strip()
+        check = STRING_CHECKERS.get(predicate)
+        if value == "" or check is None:
+            return field, _never, None
+        return field, check, value
+
+    def evaluate_rule(self, rule: Dict, email: Dict) -> bool:
+        """Evaluate a single rule"""
+        compiled = rule.get("_compiled") or self._compile_rule(rule)
+        fields = {field for field, _, _ in compiled[1]}
+        return _matches(compiled, _prepare_email(email, fields))
+
+    def evaluate_condition(self, condition: Dict, email: Dict) -> bool:
+        """Evaluate a single condition"""
+        field, check, value = self._compile_condition(condition)
+        return check(_prepare_email(email, [field])[field], value)
@@ -21,30 +21,30 @@ class RuleValidator:
     }
     
     # String predicates from assignment
-    STRING_PREDICATES = [
+    STRING_PREDICATES = frozenset([
         'contains',
         'does_not_contain',
         'equals',
         'does_not_equal'
-    ]
+    ])
     
     # Date predicates from assignment
-    DATE_PREDICATES = [
+    DATE_PREDICATES = frozenset([
         'less_than',     # Less than X days/months
         'greater_than'   # Greater than X days/months
-    ]
+    ])
     
     # Rule-level predicates from assignment
-    RULE_PREDICATES = ['all', 'any']
+    RULE_PREDICATES = frozenset(['all', 'any'])
     
     # Actions from assignment
-    SUPPORTED_ACTIONS = [
+    SUPPORTED_ACTIONS = frozenset([
         'mark_as_read',
         'mark_as_unread',
         'move_message'
-    ]
+    ])
     
-    VALID_DATE_UNITS = ['days', 'months']
+    VALID_DATE_UNITS = frozenset(['days', 'months'])
     
     # Reasonable limits
     MAX_CONDITIONS = 10
@@ -70,6 +70,13 @@ class RuleValidator:
             self._add_error(f"Invalid JSON: {e}")
             return False
         
+        return self.validate_rules(data)
+    
+    def validate_rules(self, data: Dict) -> bool:
+        """Validate already-parsed rules data (the contents of a rules file)"""
+        self.errors = []
+        self.warnings = []
+        
         if not isinstance(data, dict) or 'rules' not in data:
             self._add_error("Rules file must contain 'rules' array")
             return False
@@ -106,7 +113,8 @@ class RuleValidator:
         
         # Validate predicate
         if 'predicate' in rule:
-            if rule['predicate'].lower() not in self.RULE_PREDICATES:
+            predicate = rule['predicate']
+            if not (isinstance(predicate, str) and predicate.lower() in self.RULE_PREDICATES):
                 self._add_error(
                     f"Rule '{rule_name}': Invalid predicate '{rule['predicate']}'. "
                     f"Must be 'all' or 'any'"
@@ -146,7 +154,7 @@ class RuleValidator:
         predicate = condition['predicate']
         
         # Validate field
-        if field not in self.SUPPORTED_FIELDS:
+        if not self._is_one_of(field, self.SUPPORTED_FIELDS):
             self._add_error(
                 f"Rule '{rule_name}', Condition #{idx + 1}: Invalid field '{field}'. "
                 f"Supported: from, subject, message, received_date"
@@ -156,13 +164,13 @@ class RuleValidator:
         field_type = self.SUPPORTED_FIELDS[field]
         
         # Validate predicate for field type
-        if field_type == 'string' and predicate not in self.STRING_PREDICATES:
+        if field_type == 'string' and not self._is_one_of(predicate, self.STRING_PREDICATES):
             self._add_error(
                 f"Rule '{rule_name}', Condition #{idx + 1}: "
                 f"Invalid predicate '{predicate}' for string field"
             )
         elif field_type == 'date':
-            if predicate not in self.DATE_PREDICATES:
+            if not self._is_one_of(predicate, self.DATE_PREDICATES):
                 self._add_error(
                     f"Rule '{rule_name}', Condition #{idx + 1}: "
                     f"Invalid predicate '{predicate}' for date field"
@@ -173,7 +181,7 @@ class RuleValidator:
                     f"Rule '{rule_name}', Condition #{idx + 1}: "
                     f"Date conditions require 'unit' (days/months)"
                 )
-            elif condition['unit'] not in self.VALID_DATE_UNITS:
+            elif not self._is_one_of(condition['unit'], self.VALID_DATE_UNITS):
                 self._add_error(
                     f"Rule '{rule_name}', Condition #{idx + 1}: "
                     f"Invalid unit '{condition['unit']}'"
@@ -187,7 +195,7 @@ class RuleValidator:
                         f"Rule '{rule_name}', Condition #{idx + 1}: "
                         f"Date value must be positive"
                     )
-            except ValueError:
+            except (TypeError, ValueError):
                 self._add_error(
                     f"Rule '{rule_name}', Condition #{idx + 1}: "
                     f"Date value must be numeric"
@@ -201,7 +209,7 @@ class RuleValidator:
         
         action_type = action['type']
         
-        if action_type not in self.SUPPORTED_ACTIONS:
+        if not self._is_one_of(action_type, self.SUPPORTED_ACTIONS):
             self._add_error(
                 f"Rule '{rule_name}', Action #{idx + 1}: "
                 f"Invalid action '{action_type}'"
@@ -247,6 +255,14 @@ class RuleValidator:
                     f"email will have all labels: {', '.join(destinations)}"
                 )
     
+    @staticmethod
+    def _is_one_of(value, allowed) -> bool:
+        """
+        Membership test that reports a non-string value (e.g. a JSON list,
+        which is unhashable) as not allowed instead of raising TypeError
+        """
+        return isinstance(value, str) and value in allowed
+    
     def _add_error(self, message: str):
         self.errors.append(f"ERROR: {message}")
     
@@ -1,9 +1,11 @@
 """
 Pytest fixtures for all tests
 """
+import psycopg2
 import pytest
-import tempfile
 import json
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from src.database import EmailDatabase
 from src.rule_engine import RuleEngine
@@ -20,33 +22,101 @@ TEST_DB_CONFIG = {
     "password": os.getenv("DB_TEST_PASSWORD", ""),
     "host": os.getenv("DB_TEST_HOST", "localhost"),
     "port": int(os.getenv("DB_TEST_PORT", 5432)),
+    # Throwaway data: acknowledge commits without waiting for the WAL flush
+    "options": "-c synchronous_commit=off",
 }
 
+# Under pytest-xdist each worker keeps its tables in a schema of its own
+XDIST_WORKER = os.getenv("PYTEST_XDIST_WORKER")
+if XDIST_WORKER:
+    TEST_DB_CONFIG["options"] += f" -c search_path=test_{XDIST_WORKER}"
 
-@pytest.fixture(scope="function")
-def test_db():
-    """Provide clean test database for each test"""
-    db = EmailDatabase(TEST_DB_CONFIG)
 
-    # Clear all data before test
-    conn = db.get_connection()
+class FakeClock:
+    """Strictly increasing timestamps one microsecond apart, so version
+    timestamps never collide and tests need not sleep between updates"""
+
+    def __init__(self, start=datetime(2024, 1, 1)):
+        self.start = start
+        self._ticks = itertools.count()  # next() is atomic under the GIL
+
+    def __call__(self):
+        return self.start + timedelta(microseconds=next(self._ticks))
+
+
+def _skip_wal(db):
+    """Test rows are disposable, so keep the emails table out of the WAL"""
+    with db._conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT relpersistence FROM pg_class WHERE oid = 'emails'::regclass"
+        )
+        if cursor.fetchone()[0] != "u":
+            cursor.execute("ALTER TABLE emails SET UNLOGGED")
+        conn.commit()
+        cursor.close()
+
+
+def _clear_emails(db):
+    with db._conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM emails")
+        conn.commit()
+        cursor.close()
+
+
+def _create_worker_schema():
+    conn = psycopg2.connect(**TEST_DB_CONFIG)
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM emails")
+    cursor.execute(f"CREATE SCHEMA IF NOT EXISTS test_{XDIST_WORKER}")
     conn.commit()
     cursor.close()
     conn.close()
 
+
+@pytest.fixture(scope="session")
+def session_db():
+    """One database (connection pool and schema check) for the whole run"""
+    if XDIST_WORKER:
+        _create_worker_schema()
+    db = EmailDatabase(TEST_DB_CONFIG, clock=FakeClock())
+    _skip_wal(db)
     yield db
+    _clear_emails(db)
+    db.close()
 
-    # Cleanup after test
-    conn = db.get_connection()
+
+@pytest.fixture(scope="function")
+def test_db(session_db):
+    """Provide clean test database for each test"""
+    _clear_emails(session_db)
+    yield session_db
+
+
+@pytest.fixture
+def scratch_db_config():
+    """Config for a schema of this test's own, created empty and dropped after"""
+    schema = f"scratch_{XDIST_WORKER or 'main'}"
+    conn = psycopg2.connect(**TEST_DB_CONFIG)
+    conn.autocommit = True
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM emails")
-    conn.commit()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {schema}")
+    yield dict(
+        TEST_DB_CONFIG, options=f"{TEST_DB_CONFIG['options']} -c search_path={schema}"
+    )
+    cursor.execute(f"DROP SCHEMA {schema} CASCADE")
     cursor.close()
     conn.close()
 
 
+@pytest.fixture(scope="session")
+def thread_pool():
+    """Worker threads shared by the concurrency tests"""
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        yield executor
+
+
 @pytest.fixture
 def sample_email():
     """Standard sample email for testing"""
@@ -62,38 +132,48 @@ def sample_email():
     }
 
 
+# Built once per run; the fixture hands out fresh copies since tests edit them
+_BATCH_BASE_TIME = datetime.now()
+SAMPLE_EMAILS_BATCH = tuple(
+    {
+        "id": f"email_{i:03d}",
+        "thread_id": f"thread_{i:03d}",
+        "from": f"sender{i}@example.com",
+        "to": "receiver@example.com",
+        "subject": f"Subject {i}",
+        "message": f"Message content {i}",
+        "received_date": _BATCH_BASE_TIME - timedelta(days=i),
+        "labels": ("INBOX", "UNREAD") if i % 2 == 0 else ("INBOX",),
+    }
+    for i in range(10)
+)
+
+
 @pytest.fixture
 def sample_emails_batch():
     """Batch of sample emails"""
-    base_time = datetime.now()
-    return [
-        {
-            "id": f"email_{i:03d}",
-            "thread_id": f"thread_{i:03d}",
-            "from": f"sender{i}@example.com",
-            "to": "receiver@example.com",
-            "subject": f"Subject {i}",
-            "message": f"Message content {i}",
-            "received_date": base_time - timedelta(days=i),
-            "labels": ["INBOX", "UNREAD"] if i % 2 == 0 else ["INBOX"],
-        }
-        for i in range(10)
-    ]
+    return [{**email, "labels": list(email["labels"])} for email in SAMPLE_EMAILS_BATCH]
 
 
 @pytest.fixture
-def temp_rules_file():
-    """Create temporary rules file"""
+def temp_rules_file(tmp_path):
+    """Create temporary rules file (removed by pytest with the test's tmp_path)"""
+    names = itertools.count()
 
     def _create_rules(rules_data):
-        temp_file = tempfile.NamedTemporaryFile(mode="w", suffix=".json", delete=False)
-        json.dump(rules_data, temp_file)
-        temp_file.close()
-        return temp_file.name
+        path = tmp_path / f"rules_{next(names)}.json"
+        path.write_text(json.dumps(rules_data))
+        return str(path)
 
     return _create_rules
 
 
+@pytest.fixture
+def validator():
+    """Fresh rule validator"""
+    return RuleValidator()
+
+
 @pytest.fixture
 def valid_rule():
     """Valid rule for testing"""
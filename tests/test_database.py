@@ -1,8 +1,15 @@
 """
 Tests for database based overall operations
 """
-from datetime import datetime
-import time
+from datetime import datetime, timedelta, timezone
+import psycopg2
+import pytest
+import src.database as database
+from src.database import SCHEMA_VERSION
+
+LONG_SUBJECT = "A" * 10000
+UNICODE_SUBJECT = "Hello 世界 🌍 Test 🎉"
+FIXED_TS = datetime(2024, 1, 1, 12, 0, 0)
 
 
 class TestDatabaseBasics:
@@ -12,39 +19,105 @@ class TestDatabaseBasics:
 
     def test_create_tables(self, test_db):
         """Test table creation"""
-        conn = test_db.get_connection()
-        cursor = conn.cursor()
+        with test_db._conn() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(
+                """
+                SELECT EXISTS (
+                    SELECT FROM information_schema.tables
+                    WHERE table_schema = current_schema()
+                    AND table_name = 'emails'
+                )
+            """
+            )
+            assert cursor.fetchone()[0] is True
 
-        cursor.execute(
+            cursor.execute(
+                """
+                SELECT COUNT(*) FROM pg_indexes
+                WHERE schemaname = current_schema()
+                AND tablename = 'emails'
             """
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_name = 'emails'
             )
-        """
-        )
-        assert cursor.fetchone()[0] == True
+            index_count = cursor.fetchone()[0]
+            assert index_count >= 4  # Should have 4+ indexes
+
+            cursor.close()
+
+    def test_schema_version_recorded(self, test_db):
+        """Test the schema version is recorded so later runs skip the DDL"""
+        assert test_db._schema_version() == SCHEMA_VERSION
 
+    def test_labels_column_is_text_array(self, test_db):
+        """Test labels are stored as a native TEXT[] column"""
+        with test_db._conn() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(
+                """
+                SELECT data_type FROM information_schema.columns
+                WHERE table_schema = current_schema()
+                AND table_name = 'emails' AND column_name = 'labels'
+            """
+            )
+            assert cursor.fetchone()[0] == "ARRAY"
+
+            cursor.close()
+
+    def test_legacy_json_labels_column_is_migrated(self, scratch_db_config):
+        """Test a JSON-encoded TEXT labels column is converted to TEXT[]"""
+        conn = psycopg2.connect(**scratch_db_config)
+        cursor = conn.cursor()
         cursor.execute(
             """
-            SELECT COUNT(*) FROM pg_indexes 
-            WHERE tablename = 'emails'
+            CREATE TABLE emails (
+                email_id VARCHAR(255) NOT NULL,
+                valid_from TIMESTAMP NOT NULL,
+                thread_id VARCHAR(255),
+                from_email TEXT,
+                to_email TEXT,
+                subject TEXT,
+                message TEXT,
+                received_date TIMESTAMP,
+                labels TEXT,
+                valid_to TIMESTAMP,
+                is_current BOOLEAN DEFAULT TRUE,
+                fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (email_id, valid_from)
+            )
         """
         )
-        index_count = cursor.fetchone()[0]
-        assert index_count >= 4  # Should have 4+ indexes
-
-        cursor.close()
-        conn.close()
+        cursor.execute(
+            "INSERT INTO emails (email_id, valid_from, labels) VALUES (%s, %s, %s)",
+            ("legacy_001", FIXED_TS, '["INBOX", "Work"]'),
+        )
+        conn.commit()
+
+        db = database.EmailDatabase(scratch_db_config)
+        try:
+            assert db.get_email_by_id("legacy_001")["labels"] == ["INBOX", "Work"]
+            cursor.execute(
+                """
+                SELECT data_type FROM information_schema.columns
+                WHERE table_schema = current_schema()
+                AND table_name = 'emails' AND column_name = 'labels'
+            """
+            )
+            assert cursor.fetchone()[0] == "ARRAY"
+        finally:
+            db.close()
+            cursor.close()
+            conn.close()
 
     def test_insert_single_email(self, test_db, sample_email):
         """Test inserting a single email"""
         test_db.insert_or_update_email(sample_email)
 
-        retrieved = test_db.get_all_emails()
-        assert len(retrieved) == 1
-        assert retrieved[0]["id"] == sample_email["id"]
-        assert retrieved[0]["from"] == sample_email["from"]
+        assert test_db.count_emails() == 1
+        retrieved = test_db.get_email_by_id(sample_email["id"])
+        assert retrieved["id"] == sample_email["id"]
+        assert retrieved["from"] == sample_email["from"]
 
     def test_insert_batch_emails(self, test_db, sample_emails_batch):
         """Test batch email insertion"""
@@ -53,6 +126,13 @@ class TestDatabaseBasics:
         emails = test_db.get_all_emails()
         assert len(emails) == len(sample_emails_batch)
 
+    def test_iter_all_emails_streams_in_order(self, test_db, sample_emails_batch):
+        """Test streaming emails across several server-side cursor fetches"""
+        test_db.insert_emails_batch(sample_emails_batch)
+
+        streamed = list(test_db.iter_all_emails(itersize=3))
+        assert [e["id"] for e in streamed] == [e["id"] for e in sample_emails_batch]
+
     def test_get_email_by_id(self, test_db, sample_email):
         """Test retrieving email by ID"""
         test_db.insert_or_update_email(sample_email)
@@ -82,80 +162,70 @@ class TestDatabaseBasics:
         assert stats["current_versions"] == len(sample_emails_batch)
         assert stats["historical_versions"] == 0
 
-    def test_insert_email_with_empty_fields(self, test_db):
-        """Test inserting email with missing/empty fields"""
-        email = {
-            "id": "test_empty",
-            "from": "",
-            "to": "",
-            "subject": None,
-            "message": "",
-            "received_date": None,
-            "labels": [],
-        }
-
-        test_db.insert_or_update_email(email)
-        retrieved = test_db.get_all_emails()
-        assert len(retrieved) == 1
-        assert retrieved[0]["from"] == ""
-        assert retrieved[0]["subject"] is None
-
-    def test_insert_email_with_very_long_subject(self, test_db):
-        """Test email with extremely long subject"""
-        email = {
-            "id": "test_long",
-            "from": "sender@example.com",
-            "subject": "A" * 10000,
-            "message": "Test",
-            "received_date": datetime.now(),
-            "labels": ["INBOX"],
-        }
-
-        test_db.insert_or_update_email(email)
-        retrieved = test_db.get_all_emails()
-        assert len(retrieved) == 1
-        assert len(retrieved[0]["subject"]) == 10000
-
-    def test_insert_email_with_special_characters(self, test_db):
-        """Test email with special characters"""
-        email = {
-            "id": "test_special",
-            "from": "sender+tag@example.com",
-            "subject": "Test \"quoted\" subject with 'quotes' and <html>",
-            "message": "Message with\nnewlines\tand\ttabs",
-            "received_date": datetime.now(),
-            "labels": ["INBOX"],
-        }
-
-        test_db.insert_or_update_email(email)
-        retrieved = test_db.get_all_emails()
-        assert len(retrieved) == 1
-        assert '"quoted"' in retrieved[0]["subject"]
-
-    def test_insert_email_with_unicode_and_emojis(self, test_db):
-        """Test email with unicode and emoji characters"""
-        email = {
-            "id": "test_unicode",
-            "from": "sender@例え.jp",
-            "subject": "Hello 世界 🌍 Test 🎉",
-            "message": "Content with 中文 and العربية",
-            "received_date": datetime.now(),
-            "labels": ["INBOX"],
-        }
-
+    @pytest.mark.parametrize(
+        "email,check",
+        [
+            (
+                {
+                    "id": "test_empty",
+                    "from": "",
+                    "to": "",
+                    "subject": None,
+                    "message": "",
+                    "received_date": None,
+                    "labels": [],
+                },
+                lambda r: r["from"] == "" and r["subject"] is None,
+            ),
+            (
+                {
+                    "id": "test_long",
+                    "from": "sender@example.com",
+                    "subject": LONG_SUBJECT,
+                    "message": "Test",
+                    "received_date": FIXED_TS,
+                    "labels": ["INBOX"],
+                },
+                lambda r: r["subject"] == LONG_SUBJECT,
+            ),
+            (
+                {
+                    "id": "test_special",
+                    "from": "sender+tag@example.com",
+                    "subject": "Test \"quoted\" subject with 'quotes' and <html>",
+                    "message": "Message with\nnewlines\tand\ttabs",
+                    "received_date": FIXED_TS,
+                    "labels": ["INBOX"],
+                },
+                lambda r: '"quoted"' in r["subject"],
+            ),
+            (
+                {
+                    "id": "test_unicode",
+                    "from": "sender@例え.jp",
+                    "subject": UNICODE_SUBJECT,
+                    "message": "Content with 中文 and العربية",
+                    "received_date": FIXED_TS,
+                    "labels": ["INBOX"],
+                },
+                lambda r: r["subject"] == UNICODE_SUBJECT,
+            ),
+        ],
+        ids=["empty_fields", "very_long_subject", "special_characters", "unicode"],
+    )
+    def test_insert_email_variant(self, test_db, email, check):
+        """Test inserting emails with empty, long, special and unicode fields"""
         test_db.insert_or_update_email(email)
-        retrieved = test_db.get_all_emails()
-        assert len(retrieved) == 1
-        assert "世界" in retrieved[0]["subject"]
-        assert "🌍" in retrieved[0]["subject"]
+        assert test_db.count_emails() == 1
+        assert check(test_db.get_email_by_id(email["id"]))
 
     def test_insert_duplicate_email_id(self, test_db, sample_email):
         """Test inserting same email ID twice"""
         test_db.insert_or_update_email(sample_email)
         test_db.insert_or_update_email(sample_email)
 
-        emails = test_db.get_all_emails()
-        assert len(emails) == 1
+        assert test_db.count_emails() == 1
+        assert len(test_db.get_email_history(sample_email["id"])) == 1
 
 
 class TestBitemporalTracking:
@@ -169,7 +239,7 @@ class TestBitemporalTracking:
 
         history = test_db.get_email_history(sample_email["id"])
         assert len(history) == 1
-        assert history[0]["is_current"] == True
+        assert history[0]["is_current"] is True
         assert history[0]["valid_to"] is None
 
     def test_unchanged_email_no_new_version(self, test_db, sample_email):
@@ -181,11 +251,39 @@ class TestBitemporalTracking:
         history = test_db.get_email_history(sample_email["id"])
         assert len(history) == 1  # Still only 1 version
 
+    def test_reordered_labels_no_new_version(self, test_db, sample_email):
+        """Test that labels are compared as a set, ignoring order"""
+        test_db.insert_or_update_email(sample_email)
+
+        sample_email["labels"] = list(reversed(sample_email["labels"]))
+        test_db.insert_or_update_email(sample_email)
+
+        history = test_db.get_email_history(sample_email["id"])
+        assert len(history) == 1
+
+    def test_rows_without_labels_hash_compare_labels(self, test_db, sample_email):
+        """Test change detection for rows written before labels_hash existed"""
+        test_db.insert_or_update_email(sample_email)
+
+        with test_db._conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE emails SET labels_hash = NULL")
+            conn.commit()
+            cursor.close()
+
+        sample_email["labels"] = list(reversed(sample_email["labels"]))
+        test_db.insert_or_update_email(sample_email)
+        test_db.insert_emails_batch([sample_email])
+        assert len(test_db.get_email_history(sample_email["id"])) == 1
+
+        sample_email["labels"] = ["INBOX"]
+        test_db.insert_or_update_email(sample_email)
+        assert len(test_db.get_email_history(sample_email["id"])) == 2
+
     def test_changed_labels_create_new_version(self, test_db, sample_email):
         """Test that label changes create new version"""
         # Insert initial version
         test_db.insert_or_update_email(sample_email)
-        time.sleep(0.01)  # Small delay to ensure different timestamps
 
         # Change labels to INBOX
         sample_email["labels"] = ["INBOX"]  # UNREAD removed
@@ -195,49 +293,42 @@ class TestBitemporalTracking:
         assert len(history) == 2
 
         # First version should be invalidated
-        assert history[0]["is_current"] == False
+        assert history[0]["is_current"] is False
         assert history[0]["valid_to"] is not None
 
         # Second version should be current
-        assert history[1]["is_current"] == True
+        assert history[1]["is_current"] is True
         assert history[1]["valid_to"] is None
 
     def test_multiple_label_changes(self, test_db, sample_email):
         """Test multiple label changes create multiple versions"""
         # Initial version: INBOX, UNREAD
         test_db.insert_or_update_email(sample_email)
-        time.sleep(0.01)
 
         # Second version: INBOX (UNREAD removed)
         sample_email["labels"] = ["INBOX"]
         test_db.insert_or_update_email(sample_email)
-        time.sleep(0.01)
 
         # Third version: INBOX, IMPORTANT
         sample_email["labels"] = ["INBOX", "IMPORTANT"]
         test_db.insert_or_update_email(sample_email)
-        time.sleep(0.01)
 
         # Fourth version: IMPORTANT (INBOX removed)
         sample_email["labels"] = ["IMPORTANT"]
         test_db.insert_or_update_email(sample_email)
 
         history = test_db.get_email_history(sample_email["id"])
-        assert len(history) == 4
 
         # Only the last version should be current
-        current_versions = [v for v in history if v["is_current"]]
-        assert len(current_versions) == 1
-        assert current_versions[0]["labels"] == ["IMPORTANT"]
+        assert [v["is_current"] for v in history] == [False, False, False, True]
+        assert test_db.get_current_labels(sample_email["id"]) == ["IMPORTANT"]
 
     def test_get_all_emails_returns_only_current(self, test_db, sample_email):
         """Test that get_all_emails returns only current versions"""
         test_db.insert_or_update_email(sample_email)
-        time.sleep(0.01)
 
         sample_email["labels"] = ["INBOX"]
         test_db.insert_or_update_email(sample_email)
-        time.sleep(0.01)
 
         sample_email["labels"] = ["IMPORTANT"]
         test_db.insert_or_update_email(sample_email)
@@ -252,7 +343,6 @@ class TestBitemporalTracking:
 
         email = sample_emails_batch[0]
         for i in range(5):
-            time.sleep(0.01)
             email["labels"] = [f"LABEL_{i}"]
             test_db.insert_or_update_email(email)
 
@@ -262,7 +352,6 @@ class TestBitemporalTracking:
     def test_stats_show_historical_versions(self, test_db, sample_email):
         """Test that stats correctly show historical versions"""
         for i in range(5):
-            time.sleep(0.01)
             sample_email["labels"] = [f"VERSION_{i}"]
             test_db.insert_or_update_email(sample_email)
 
@@ -272,21 +361,167 @@ class TestBitemporalTracking:
         assert stats["current_versions"] == 1
         assert stats["historical_versions"] == 4
 
+    def test_batch_reinsert_versions_only_changed(self, test_db, sample_emails_batch):
+        """Test that a batch re-insert only creates versions for changed labels"""
+        test_db.insert_emails_batch(sample_emails_batch)
+
+        sample_emails_batch[0]["labels"] = ["Work"]
+        sample_emails_batch[1]["subject"] = "Updated Subject"
+        test_db.insert_emails_batch(sample_emails_batch)
+
+        stats = test_db.get_stats()
+        assert stats["unique_emails"] == len(sample_emails_batch)
+        assert stats["historical_versions"] == 1
+
+        assert test_db.get_email_by_id("email_000")["labels"] == ["Work"]
+        assert test_db.get_email_by_id("email_001")["subject"] == "Updated Subject"
+        assert len(test_db.get_email_history("email_001")) == 1
+
+    def test_batch_duplicate_ids_keep_last(self, test_db, sample_email):
+        """Test that duplicate ids within one batch store the last occurrence"""
+        updated = dict(sample_email, labels=["IMPORTANT"])
+        test_db.insert_emails_batch([sample_email, updated])
+
+        history = test_db.get_email_history(sample_email["id"])
+        assert len(history) == 1
+        assert history[0]["labels"] == ["IMPORTANT"]
+
+    def test_batch_skips_email_without_id(self, test_db, sample_email, capsys):
+        """Test that an email without an id does not abort the rest of a batch"""
+        test_db.insert_emails_batch([{"subject": "No id"}, sample_email])
+
+        assert "Error inserting email: 'id'" in capsys.readouterr().out
+        assert test_db.count_emails() == 1
+        assert test_db.get_email_by_id(sample_email["id"]) is not None
+
+    @pytest.mark.parametrize("relabel", [False, True], ids=["same", "relabel"])
+    @pytest.mark.parametrize("batch", [False, True], ids=["single", "batch"])
+    def test_headers_only_fetch_keeps_stored_body(
+        self, test_db, sample_email, batch, relabel
+    ):
+        """Test an email re-fetched without its body keeps the stored body"""
+        write = (
+            (lambda email: test_db.insert_emails_batch([email]))
+            if batch
+            else test_db.insert_or_update_email
+        )
+        headers_only = {k: v for k, v in sample_email.items() if k != "message"}
+
+        write(sample_email)
+        if relabel:
+            headers_only["labels"] = ["Work"]
+        write(headers_only)
+
+        retrieved = test_db.get_email_by_id(sample_email["id"])
+        assert retrieved["message"] == sample_email["message"]
+        assert len(test_db.get_email_history(sample_email["id"])) == 1 + relabel
+
+    @pytest.mark.parametrize("batch", [False, True], ids=["single", "batch"])
+    def test_full_fetch_fills_body_of_headers_only_email(
+        self, test_db, sample_email, batch
+    ):
+        """Test a full fetch stores the body of an email first stored without"""
+        write = (
+            (lambda email: test_db.insert_emails_batch([email]))
+            if batch
+            else test_db.insert_or_update_email
+        )
+        write({k: v for k, v in sample_email.items() if k != "message"})
+        assert test_db.get_email_by_id(sample_email["id"])["message"] == ""
+
+        write(sample_email)
+        retrieved = test_db.get_email_by_id(sample_email["id"])
+        assert retrieved["message"] == sample_email["message"]
+
+    def test_copy_path_matches_insert_path(self, test_db, monkeypatch, capsys):
+        """Test that batches loaded with COPY store the same values as INSERT"""
+        base = {
+            "thread_id": None,
+            "from": 'Quote "Name", Esq. <a@x.com>',
+            "to": "",
+            "subject": "Line\nbreak, back\\slash; 日本語 🎉",
+            "message": 'He said "hi"\r\n\\N',
+        }
+        variants = [
+            {"received_date": datetime(2024, 3, 1, 12, 30, 15, 123456)},
+            {
+                "received_date": datetime(
+                    2024, 3, 1, 12, 30, tzinfo=timezone(timedelta(hours=5, minutes=30))
+                )
+            },
+            {"received_date": None, "labels": []},
+            {"labels": None},
+            {"labels": ["INBOX", 'we"ird', "back\\slash", "a,b", "{x}", "NULL"]},
+        ]
+
+        def batch(prefix):
+            return [
+                dict(base, id=f"{prefix}_{i}", **variant)
+                for i, variant in enumerate(variants)
+            ]
+
+        test_db.insert_emails_batch(batch("insert"))
+        monkeypatch.setattr(database, "COPY_MIN_ROWS", 1)
+        test_db.insert_emails_batch(batch("copy"))
+        assert "Error in batch insert" not in capsys.readouterr().out
+
+        for i in range(len(variants)):
+            inserted = test_db.get_email_by_id(f"insert_{i}")
+            copied = test_db.get_email_by_id(f"copy_{i}")
+            inserted.pop("id")
+            copied.pop("id")
+            assert copied == inserted
+
+    @pytest.mark.parametrize("batch", [False, True], ids=["single", "batch"])
+    def test_none_labels_stored_as_empty_array(self, test_db, sample_email, batch):
+        """Test labels=None is stored the same way by every write path"""
+        sample_email["labels"] = None
+        if batch:
+            test_db.insert_emails_batch([sample_email])
+        else:
+            test_db.insert_or_update_email(sample_email)
+
+        with test_db._conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT labels FROM emails WHERE email_id = %s", (sample_email["id"],)
+            )
+            assert cursor.fetchone()[0] == []
+            cursor.close()
+
+    def test_copy_batches_in_one_transaction(
+        self, test_db, sample_emails_batch, monkeypatch, capsys
+    ):
+        """Test two COPY-sized batches can be written in the same transaction"""
+        monkeypatch.setattr(database, "COPY_MIN_ROWS", 1)
+        with test_db.transaction():
+            test_db.insert_emails_batch(sample_emails_batch[:5])
+            test_db.insert_emails_batch(sample_emails_batch[5:])
+
+        assert "Error in batch insert" not in capsys.readouterr().out
+        assert test_db.count_emails() == len(sample_emails_batch)
+
     def test_rapid_successive_updates(self, test_db, sample_email):
         """Test many rapid updates in short time"""
-        for i in range(10):
-            sample_email["labels"] = [f"LABEL_{i}"]
-            test_db.insert_or_update_email(sample_email)
+        with test_db.transaction():
+            for i in range(10):
+                sample_email["labels"] = [f"LABEL_{i}"]
+                test_db.insert_or_update_email(sample_email)
 
-        history = test_db.get_email_history(sample_email["id"])
-        assert len(history) == 10
+        assert test_db.count_distinct_valid_from(sample_email["id"]) == 10
 
-        timestamps = [h["valid_from"] for h in history]
-        assert len(set(timestamps)) == 10  # All unique
+    def test_transaction_rolls_back_on_error(self, test_db, sample_email):
+        """Test writes inside a failed transaction block are discarded"""
+        with pytest.raises(RuntimeError):
+            with test_db.transaction():
+                test_db.insert_or_update_email(sample_email)
+                raise RuntimeError("abort")
+
+        assert test_db.count_emails() == 0
 
     def test_five_emails_same_sender_same_time(self, test_db):
         """Test 5 different emails from same sender at exact same time"""
-        same_time = datetime.now()
+        same_time = FIXED_TS
         same_sender = "boss@company.com"
 
         emails = [
@@ -314,7 +549,6 @@ class TestBitemporalTracking:
     def test_subject_change_not_tracked(self, test_db, sample_email):
         """Test that subject changes are not tracked"""
         test_db.insert_or_update_email(sample_email)
-        time.sleep(0.01)
 
         # Change subject
         sample_email["subject"] = "Changed Subject"
@@ -324,13 +558,12 @@ class TestBitemporalTracking:
 
         assert len(history) == 1
 
-        retrieved = test_db.get_all_emails()[0]
+        retrieved = test_db.get_email_by_id(sample_email["id"])
         assert retrieved["subject"] == "Changed Subject"
 
     def test_from_field_change_not_tracked(self, test_db, sample_email):
         """Test that from/to changes are not tracked"""
         test_db.insert_or_update_email(sample_email)
-        time.sleep(0.01)
 
         sample_email["from"] = "different@example.com"
         test_db.insert_or_update_email(sample_email)
@@ -0,0 +1,85 @@
+"""
+Tests for GmailClient label changes against a mocked Gmail service
+"""
+from unittest.mock import MagicMock
+import pytest
+import src.gmail_client as gmail_client
+from src.gmail_client import GmailClient
+
+LABELS = [
+    {"id": "INBOX", "name": "INBOX", "type": "system"},
+    {"id": "UNREAD", "name": "UNREAD", "type": "system"},
+    {"id": "SENT", "name": "SENT", "type": "system"},
+    {"id": "Label_1", "name": "Work", "type": "user"},
+]
+
+
+@pytest.fixture
+def gmail(monkeypatch):
+    """GmailClient whose service is a MagicMock listing LABELS"""
+    service = MagicMock()
+    service.users().labels().list().execute.return_value = {"labels": LABELS}
+    service.users().labels().create().execute.return_value = {
+        "id": "Label_2",
+        "name": "Archive",
+    }
+
+    def authenticate(self):
+        self._local.service = service
+
+    monkeypatch.setattr(GmailClient, "authenticate", authenticate)
+    return GmailClient()
+
+
+def batch_modify_bodies(gmail):
+    """Request bodies passed to messages.batchModify, in call order"""
+    calls = gmail.service.users().messages().batchModify.call_args_list
+    return [call.kwargs["body"] for call in calls if "body" in call.kwargs]
+
+
+class TestBatchModify:
+    """
+    Tests for batch_modify
+    """
+
+    def test_label_names_resolve_to_ids(self, gmail):
+        """Test label names are sent as IDs and missing labels are created"""
+        modified = gmail.batch_modify(["m1", "m2"], ["Archive"], ["Work", "UNREAD"])
+
+        assert modified == ["m1", "m2"]
+        assert batch_modify_bodies(gmail) == [
+            {
+                "ids": ["m1", "m2"],
+                "addLabelIds": ["Label_2"],
+                "removeLabelIds": ["Label_1", "UNREAD"],
+            }
+        ]
+
+    def test_unmodifiable_and_unknown_labels_are_not_removed(self, gmail):
+        """Test SENT and labels Gmail does not know are left out of the request"""
+        gmail.batch_modify(["m1"], ["Work"], ["SENT", "INBOX", "Gone"])
+
+        assert batch_modify_bodies(gmail)[0]["removeLabelIds"] == ["INBOX"]
+
+    def test_failed_chunk_only_loses_its_ids(self, gmail, monkeypatch, capsys):
+        """Test a failed request leaves the other chunks reported as modified"""
+        monkeypatch.setattr(gmail_client, "BATCH_MODIFY_LIMIT", 2)
+        execute = gmail.service.users().messages().batchModify().execute
+        execute.side_effect = [None, Exception("rate limited"), None]
+
+        modified = gmail.batch_modify(["m1", "m2", "m3", "m4", "m5"], ["Work"], [])
+
+        assert modified == ["m1", "m2", "m5"]
+        assert [body["ids"] for body in batch_modify_bodies(gmail)] == [
+            ["m1", "m2"],
+            ["m3", "m4"],
+            ["m5"],
+        ]
+        assert "rate limited" in capsys.readouterr().out
+
+    def test_label_creation_failure_modifies_nothing(self, gmail):
+        """Test no message is reported as modified when a label cannot be made"""
+        gmail.service.users().labels().create().execute.side_effect = Exception("quota")
+
+        assert gmail.batch_modify(["m1"], ["Archive"], []) == []
+        assert batch_modify_bodies(gmail) == []
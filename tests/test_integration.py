@@ -1,9 +1,23 @@
 import pytest
-import time
 from datetime import datetime, timedelta, timezone
+from process_rules import evaluate_in_batches
 from src.rule_engine import RuleEngine
 from src.rule_validator import RuleValidationError
 
+# received_date for tests that only track label moves (no date rules)
+RECEIVED = datetime(2024, 1, 1, 12, 0, 0)
+
+
+def move_test_email(email_id, labels):
+    """Minimal email for tests that only track label moves"""
+    return {
+        "id": email_id,
+        "from": "test@example.com",
+        "subject": "Test",
+        "received_date": RECEIVED,
+        "labels": list(labels),
+    }
+
 
 class TestIntegration:
     def test_complete_workflow_mock(
@@ -32,13 +46,9 @@ class TestIntegration:
 
         engine = RuleEngine(rules_file)
 
-        stored_emails = test_db.get_all_emails()
-        matched_count = 0
-
-        for email in stored_emails:
-            actions = engine.evaluate_rules(email)
-            if actions:
-                matched_count += 1
+        # The path process_rules takes: stream from the database, batch evaluate
+        evaluations = evaluate_in_batches(engine, test_db.iter_all_emails())
+        matched_count = sum(1 for _, actions in evaluations if actions)
 
         assert matched_count == len(emails)
 
@@ -46,16 +56,16 @@ class TestIntegration:
         self, test_db, temp_rules_file, sample_email
     ):
         """Test that processing creates temporal versions"""
-        test_db.insert_or_update_email(sample_email)
-        time.sleep(0.01)
+        with test_db.transaction():
+            test_db.insert_or_update_email(sample_email)
 
-        sample_email["labels"] = ["Work"]
-        test_db.insert_or_update_email(sample_email)
+            sample_email["labels"] = ["Work"]
+            test_db.insert_or_update_email(sample_email)
 
         history = test_db.get_email_history(sample_email["id"])
         assert len(history) == 2
-        assert history[0]["is_current"] == False
-        assert history[1]["is_current"] == True
+        assert history[0]["is_current"] is False
+        assert history[1]["is_current"] is True
 
         assert history[1]["labels"] == ["Work"]
 
@@ -124,95 +134,79 @@ class TestIntegration:
         rules_file = temp_rules_file(rules)
         engine = RuleEngine(rules_file)
 
-        emails = test_db.get_all_emails()
-        for email in emails:
-            engine.evaluate_rules(email)
-
-        emails = test_db.get_all_emails()
-        for email in emails:
-            actions = engine.evaluate_rules(email)
-            assert len(actions) > 0
+        for _ in evaluate_in_batches(engine, test_db.iter_all_emails()):
+            pass
 
-    def test_exclusive_move_behavior(self, test_db, sample_email):
+        evaluations = list(evaluate_in_batches(engine, test_db.iter_all_emails()))
+        assert len(evaluations) == len(sample_emails_batch)
+        assert all(len(actions) > 0 for _, actions in evaluations)
+
+    @pytest.mark.parametrize(
+        "initial_labels,moves",
+        [
+            pytest.param(
+                ["INBOX", "UNREAD"],
+                [["UNREAD", "Work"], ["UNREAD", "Important"]],
+                id="exclusive_move",
+            ),
+            pytest.param(
+                ["INBOX", "UNREAD", "Personal"],
+                [["UNREAD", "Work"]],
+                id="removes_previous_user_labels",
+            ),
+            pytest.param(
+                ["INBOX", "UNREAD", "STARRED", "IMPORTANT", "Personal"],
+                [["UNREAD", "STARRED", "IMPORTANT", "Work"]],
+                id="system_labels_preserved",
+            ),
+            pytest.param(
+                ["INBOX", "UNREAD", "STARRED", "IMPORTANT", "Work"],
+                [["UNREAD", "STARRED", "IMPORTANT", "Projects"]],
+                id="system_labels_preserved_other_folder",
+            ),
+            pytest.param(
+                ["INBOX", "UNREAD"],
+                [["UNREAD", "Personal"], ["UNREAD", "Work"], ["Archive"]],
+                id="sequential_moves",
+            ),
+            pytest.param(
+                ["INBOX", "UNREAD", "STARRED", "IMPORTANT", "CATEGORY_PERSONAL"],
+                [["UNREAD", "STARRED", "IMPORTANT", "CATEGORY_PERSONAL", "Work"]],
+                id="multiple_system_labels",
+            ),
+            pytest.param(
+                ["SENT", "UNREAD"],
+                [["Archive"]],
+                id="from_sent_folder",
+            ),
+            pytest.param(
+                ["INBOX"],
+                [[]],
+                id="empty_labels_after_move",
+            ),
+        ],
+    )
+    def test_move_semantics(self, test_db, initial_labels, moves):
         """
         Test exclusive move behavior (folder-style)
-        Moving to new label removes previous user labels
+        Each move replaces the current labels and leaves the previous
+        version in history
         """
-        test_db.insert_or_update_email(sample_email)
-        time.sleep(0.01)
-
-        sample_email["labels"] = ["UNREAD", "Work"]
-        test_db.insert_or_update_email(sample_email)
-        time.sleep(0.01)
-
-        current = test_db.get_email_by_id(sample_email["id"])
-        assert "Work" in current["labels"]
-        assert "INBOX" not in current["labels"]
-        assert "UNREAD" in current["labels"]
-
-        sample_email["labels"] = ["UNREAD", "Important"]
-        test_db.insert_or_update_email(sample_email)
-
-        current = test_db.get_email_by_id(sample_email["id"])
-        assert "Important" in current["labels"]
-        assert "Work" not in current["labels"]
-        assert "INBOX" not in current["labels"]
-        assert "UNREAD" in current["labels"]
-
-    def test_sequential_moves_create_history(self, test_db, sample_email):
-        """Test that sequential moves create temporal history"""
-        test_db.insert_or_update_email(sample_email)
-        time.sleep(0.01)
-
-        sample_email["labels"] = ["UNREAD", "Personal"]
-        test_db.insert_or_update_email(sample_email)
-        time.sleep(0.01)
-
-        sample_email["labels"] = ["UNREAD", "Work"]
-        test_db.insert_or_update_email(sample_email)
-        time.sleep(0.01)
-
-        sample_email["labels"] = ["Archive"]
-        test_db.insert_or_update_email(sample_email)
-
-        history = test_db.get_email_history(sample_email["id"])
-        assert len(history) == 4
-
-        current_versions = [v for v in history if v["is_current"]]
-        assert len(current_versions) == 1
-        assert "Archive" in current_versions[0]["labels"]
-
-        assert "INBOX" in history[0]["labels"]  # Original
-        assert "Personal" in history[1]["labels"]  # First move
-        assert "Work" in history[2]["labels"]  # Second move
-        assert "Archive" in history[3]["labels"]  # Final
-
-    def test_system_labels_preserved_during_moves(self, test_db):
-        """Test that system state labels (UNREAD, STARRED) are preserved"""
-        email = {
-            "id": "test_system_preserve",
-            "from": "test@example.com",
-            "subject": "Important Email",
-            "message": "Test content",
-            "received_date": datetime.now(),
-            "labels": ["INBOX", "UNREAD", "STARRED", "IMPORTANT", "Personal"],
-        }
-
-        test_db.insert_or_update_email(email)
-        time.sleep(0.01)
-
-        email["labels"] = ["UNREAD", "STARRED", "IMPORTANT", "Work"]
-        test_db.insert_or_update_email(email)
-
-        current = test_db.get_email_by_id(email["id"])
-
-        assert "UNREAD" in current["labels"]
-        assert "STARRED" in current["labels"]
-        assert "IMPORTANT" in current["labels"]
+        email = move_test_email("test_move", initial_labels)
+        with test_db.transaction():
+            test_db.insert_or_update_email(email)
+            for labels in moves:
+                email["labels"] = labels
+                test_db.insert_or_update_email(email)
 
-        assert "Work" in current["labels"]
-        assert "Personal" not in current["labels"]
-        assert "INBOX" not in current["labels"]
+        # One read covers every step: each version holds that move's labels
+        history = test_db.get_email_history(email["id"])
+        assert [v["labels"] for v in history] == [initial_labels, *moves]
+        assert [v["is_current"] for v in history] == [False] * len(moves) + [True]
+        # ...and stayed current exactly until the next move
+        assert [v["valid_to"] for v in history[:-1]] == [
+            v["valid_from"] for v in history[1:]
+        ]
 
     def test_multiple_rules_multiple_moves(self, test_db, temp_rules_file):
         """
@@ -287,14 +281,9 @@ class TestIntegration:
         rules_file = temp_rules_file(rules)
         engine = RuleEngine(rules_file)
 
-        emails = test_db.get_all_emails()
-        matched = 0
-        for email in emails:
-            actions = engine.evaluate_rules(email)
-            if actions:
-                matched += 1
+        matches = engine.evaluate_rules_in_db(test_db)
 
-        assert matched == 1
+        assert list(matches) == ["email_000"]
 
     def test_rule_with_any_predicate(
         self, test_db, temp_rules_file, sample_emails_batch
@@ -319,14 +308,85 @@ class TestIntegration:
         rules_file = temp_rules_file(rules)
         engine = RuleEngine(rules_file)
 
-        emails = test_db.get_all_emails()
-        matched = 0
-        for email in emails:
+        matches = engine.evaluate_rules_in_db(test_db)
+
+        assert sorted(matches) == ["email_000", "email_001"]
+
+    def test_rules_in_db_match_python_evaluation(
+        self, test_db, temp_rules_file, sample_emails_batch
+    ):
+        """Test SQL pushdown gives the same actions as per-email evaluation"""
+        sample_emails_batch[3]["subject"] = "  URGENT: Subject 3\n"
+        sample_emails_batch[5]["subject"] = "\xa0Subject 5\u3000"  # Unicode spaces
+        sample_emails_batch[4]["received_date"] = None
+        test_db.insert_emails_batch(sample_emails_batch)
+
+        rules = {
+            "rules": [
+                {
+                    "name": "Recent urgent",
+                    "predicate": "all",
+                    "conditions": [
+                        {
+                            "field": "subject",
+                            "predicate": "contains",
+                            "value": "urgent",
+                        },
+                        {
+                            "field": "received_date",
+                            "predicate": "less_than",
+                            "value": 5,
+                            "unit": "days",
+                        },
+                    ],
+                    "actions": [{"type": "mark_as_read"}],
+                },
+                {
+                    "name": "Old or exact",
+                    "predicate": "any",
+                    "conditions": [
+                        {
+                            "field": "received_date",
+                            "predicate": "greater_than",
+                            "value": 6,
+                            "unit": "days",
+                        },
+                        {
+                            "field": "from",
+                            "predicate": "equals",
+                            "value": "SENDER1@example.com",
+                        },
+                    ],
+                    "actions": [{"type": "move_message", "destination": "Archive"}],
+                },
+                {
+                    "name": "Not sender2",
+                    "predicate": "all",
+                    "conditions": [
+                        {
+                            "field": "from",
+                            "predicate": "does_not_contain",
+                            "value": "sender2",
+                        },
+                        {
+                            "field": "subject",
+                            "predicate": "does_not_equal",
+                            "value": "subject 5",
+                        },
+                    ],
+                    "actions": [{"type": "mark_as_unread"}],
+                },
+            ]
+        }
+        engine = RuleEngine(temp_rules_file(rules))
+
+        expected = {}
+        for email in test_db.get_all_emails():
             actions = engine.evaluate_rules(email)
             if actions:
-                matched += 1
+                expected[email["id"]] = actions
 
-        assert matched == 2
+        assert engine.evaluate_rules_in_db(test_db) == expected
 
     def test_date_based_rules(self, test_db, temp_rules_file):
         """Test rules with date conditions"""
@@ -492,21 +552,13 @@ class TestEdgeCases:
         retrieved = test_db.get_all_emails()[0]
         assert len(retrieved["labels"]) == 3
 
-    def test_concurrent_email_updates(self, test_db, sample_email):
-        import threading
-
+    def test_concurrent_email_updates(self, test_db, sample_email, thread_pool):
         def update_email(label_name):
             email = sample_email.copy()
             email["labels"] = [label_name]
             test_db.insert_or_update_email(email)
 
-        threads = []
-        for i in range(5):
-            t = threading.Thread(target=update_email, args=(f"LABEL_{i}",))
-            threads.append(t)
-            t.start()
-        for t in threads:
-            t.join()
+        list(thread_pool.map(update_email, [f"LABEL_{i}" for i in range(5)]))
         history = test_db.get_email_history(sample_email["id"])
         assert len(history) >= 1
 
@@ -617,8 +669,7 @@ class TestEdgeCases:
             "labels": ["INBOX"],
         }
         test_db.insert_or_update_email(email)
-        retrieved = test_db.get_all_emails()[0]
-        assert len(retrieved["message"]) == len(large_message)
+        assert test_db.get_message_length(email["id"]) == len(large_message)
 
     def test_regex_patterns_in_rule_values(self, temp_rules_file):
         rules = {
@@ -791,128 +842,26 @@ class TestEdgeCases:
             "Test@Example.Com",
             "TeSt@ExAmPlE.cOm",
         ]
-        for email_addr in variations:
-            email = {"from": email_addr}
-            actions = engine.evaluate_rules(email)
+        results = engine.evaluate_rules_batch([{"from": v} for v in variations])
+        for email_addr, actions in zip(variations, results):
             assert len(actions) > 0, f"Failed for: {email_addr}"
 
-    def test_exclusive_move_removes_previous_user_labels(self, test_db):
-        email = {
-            "id": "test_exclusive_move",
-            "from": "test@example.com",
-            "subject": "Test",
-            "received_date": datetime.now(),
-            "labels": ["INBOX", "UNREAD", "Personal"],
-        }
-        test_db.insert_or_update_email(email)
-        time.sleep(0.01)
-        email["labels"] = ["UNREAD", "Work"]
-        test_db.insert_or_update_email(email)
-        current = test_db.get_email_by_id(email["id"])
-        assert "Work" in current["labels"]
-        assert "Personal" not in current["labels"]
-        assert "INBOX" not in current["labels"]
-        assert "UNREAD" in current["labels"]
-
-    def test_system_labels_preserved_during_move(self, test_db):
-        email = {
-            "id": "test_system_labels",
-            "from": "test@example.com",
-            "subject": "Test",
-            "received_date": datetime.now(),
-            "labels": ["INBOX", "UNREAD", "STARRED", "IMPORTANT", "Work"],
-        }
-        test_db.insert_or_update_email(email)
-        time.sleep(0.01)
-        email["labels"] = ["UNREAD", "STARRED", "IMPORTANT", "Projects"]
-        test_db.insert_or_update_email(email)
-        current = test_db.get_email_by_id(email["id"])
-        assert "UNREAD" in current["labels"]
-        assert "STARRED" in current["labels"]
-        assert "IMPORTANT" in current["labels"]
-        assert "Projects" in current["labels"]
-        assert "Work" not in current["labels"]
-        assert "INBOX" not in current["labels"]
-
     def test_move_to_same_label_idempotent(self, test_db):
-        email = {
-            "id": "test_idempotent",
-            "from": "test@example.com",
-            "subject": "Test",
-            "received_date": datetime.now(),
-            "labels": ["Work", "UNREAD"],
-        }
+        email = move_test_email("test_idempotent", ["Work", "UNREAD"])
         test_db.insert_or_update_email(email)
-        time.sleep(0.01)
         email["labels"] = ["Work", "UNREAD"]
         test_db.insert_or_update_email(email)
         history = test_db.get_email_history(email["id"])
         assert len(history) == 1
 
-    def test_multiple_sequential_moves(self, test_db):
-        email = {
-            "id": "test_sequential_moves",
-            "from": "test@example.com",
-            "subject": "Test",
-            "received_date": datetime.now(),
-            "labels": ["INBOX", "UNREAD"],
-        }
-        test_db.insert_or_update_email(email)
-        time.sleep(0.01)
-        email["labels"] = ["UNREAD", "Personal"]
-        test_db.insert_or_update_email(email)
-        time.sleep(0.01)
-        current = test_db.get_email_by_id(email["id"])
-        assert "Personal" in current["labels"]
-        assert "INBOX" not in current["labels"]
-        email["labels"] = ["UNREAD", "Work"]
-        test_db.insert_or_update_email(email)
-        time.sleep(0.01)
-        current = test_db.get_email_by_id(email["id"])
-        assert "Work" in current["labels"]
-        assert "Personal" not in current["labels"]
-        assert "INBOX" not in current["labels"]
-        email["labels"] = ["Archive"]
-        test_db.insert_or_update_email(email)
-        current = test_db.get_email_by_id(email["id"])
-        assert "Archive" in current["labels"]
-        assert "Work" not in current["labels"]
-        assert "Personal" not in current["labels"]
-        assert "UNREAD" not in current["labels"]
-        history = test_db.get_email_history(email["id"])
-        assert len(history) == 4
-
-    def test_inbox_always_removed_on_move(self, test_db):
-        email = {
-            "id": "test_inbox_removal",
-            "from": "test@example.com",
-            "subject": "Test",
-            "received_date": datetime.now(),
-            "labels": ["INBOX", "UNREAD", "Personal"],
-        }
-        test_db.insert_or_update_email(email)
-        time.sleep(0.01)
-        email["labels"] = ["UNREAD", "Work"]
-        test_db.insert_or_update_email(email)
-        current = test_db.get_email_by_id(email["id"])
-        assert "INBOX" not in current["labels"]
-        assert "Work" in current["labels"]
-
     def test_temporal_history_tracks_all_moves(self, test_db):
-        email = {
-            "id": "test_move_history",
-            "from": "test@example.com",
-            "subject": "Test",
-            "received_date": datetime.now(),
-            "labels": ["INBOX"],
-        }
-        test_db.insert_or_update_email(email)
-        time.sleep(0.01)
+        email = move_test_email("test_move_history", ["INBOX"])
         moves = ["Personal", "Work", "Projects", "Archive"]
-        for label in moves:
-            email["labels"] = [label]
+        with test_db.transaction():
             test_db.insert_or_update_email(email)
-            time.sleep(0.01)
+            for label in moves:
+                email["labels"] = [label]
+                test_db.insert_or_update_email(email)
         history = test_db.get_email_history(email["id"])
         assert len(history) == 5
         current_versions = [v for v in history if v["is_current"]]
@@ -924,76 +873,11 @@ class TestEdgeCases:
         assert "Projects" in history[3]["labels"]
         assert "Archive" in history[4]["labels"]
 
-    def test_move_with_multiple_system_labels(self, test_db):
-        email = {
-            "id": "test_multiple_system",
-            "from": "test@example.com",
-            "subject": "Test",
-            "received_date": datetime.now(),
-            "labels": ["INBOX", "UNREAD", "STARRED", "IMPORTANT", "CATEGORY_PERSONAL"],
-        }
-        test_db.insert_or_update_email(email)
-        time.sleep(0.01)
-        email["labels"] = [
-            "UNREAD",
-            "STARRED",
-            "IMPORTANT",
-            "CATEGORY_PERSONAL",
-            "Work",
-        ]
-        test_db.insert_or_update_email(email)
-        current = test_db.get_email_by_id(email["id"])
-        assert "UNREAD" in current["labels"]
-        assert "STARRED" in current["labels"]
-        assert "IMPORTANT" in current["labels"]
-        assert "CATEGORY_PERSONAL" in current["labels"]
-        assert "Work" in current["labels"]
-        assert "INBOX" not in current["labels"]
-
-    def test_move_from_sent_folder(self, test_db):
-        email = {
-            "id": "test_sent_move",
-            "from": "me@example.com",
-            "subject": "Test",
-            "received_date": datetime.now(),
-            "labels": ["SENT", "UNREAD"],
-        }
-        test_db.insert_or_update_email(email)
-        time.sleep(0.01)
-        email["labels"] = ["Archive"]
-        test_db.insert_or_update_email(email)
-        current = test_db.get_email_by_id(email["id"])
-        assert "SENT" not in current["labels"]
-        assert "Archive" in current["labels"]
-
     def test_rapid_moves_all_tracked(self, test_db):
-        email = {
-            "id": "test_rapid",
-            "from": "test@example.com",
-            "subject": "Test",
-            "received_date": datetime.now(),
-            "labels": ["INBOX"],
-        }
-        test_db.insert_or_update_email(email)
-        for i in range(10):
-            email["labels"] = [f"Label_{i}"]
+        email = move_test_email("test_rapid", ["INBOX"])
+        with test_db.transaction():
             test_db.insert_or_update_email(email)
-        history = test_db.get_email_history(email["id"])
-        assert len(history) == 11
-        timestamps = [h["valid_from"] for h in history]
-        assert len(set(timestamps)) == 11
-
-    def test_empty_labels_after_move(self, test_db):
-        email = {
-            "id": "test_empty_labels",
-            "from": "test@example.com",
-            "subject": "Test",
-            "received_date": datetime.now(),
-            "labels": ["INBOX"],
-        }
-        test_db.insert_or_update_email(email)
-        time.sleep(0.01)
-        email["labels"] = []
-        test_db.insert_or_update_email(email)
-        current = test_db.get_email_by_id(email["id"])
-        assert current["labels"] == []
+            for i in range(10):
+                email["labels"] = [f"Label_{i}"]
+                test_db.insert_or_update_email(email)
+        assert test_db.count_distinct_valid_from(email["id"]) == 11
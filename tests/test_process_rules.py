@@ -0,0 +1,254 @@
+"""
+Tests for process_rules: the rules cache and turning actions into
+Gmail label changes
+"""
+import json
+import os
+import stat
+from unittest.mock import MagicMock
+import process_rules
+from process_rules import (
+    execute_action,
+    load_engine,
+    send_label_changes,
+    stage_label_change,
+)
+
+
+def rules_with_name(valid_rule, name):
+    return {"rules": [{**valid_rule, "name": name}]}
+
+
+def cache_files(rules_file):
+    directory = os.path.dirname(rules_file)
+    return sorted(name for name in os.listdir(directory) if name.endswith(".pkl"))
+
+
+class TestRulesCache:
+    """
+    Tests for load_engine's pickled engine cache
+    """
+
+    def test_unchanged_rules_load_from_cache(self, temp_rules_file, valid_rule, capsys):
+        """Test the second load of an unchanged rules file uses the cache"""
+        rules_file = temp_rules_file(rules_with_name(valid_rule, "Cached"))
+
+        load_engine(rules_file)
+        assert "from cache" not in capsys.readouterr().out
+
+        engine = load_engine(rules_file)
+        assert "from cache" in capsys.readouterr().out
+        assert [rule["name"] for rule in engine.rules] == ["Cached"]
+        assert len(cache_files(rules_file)) == 1
+
+    def test_cache_hit_prints_validation_warnings(
+        self, temp_rules_file, valid_rule, capsys
+    ):
+        """Test warnings are shown again when the engine comes from the cache"""
+        rule = {**valid_rule, "actions": [{"type": "mark_as_read"}] * 2}
+        rules_file = temp_rules_file({"rules": [rule]})
+
+        load_engine(rules_file)
+        capsys.readouterr()
+        load_engine(rules_file)
+
+        out = capsys.readouterr().out
+        assert "from cache" in out
+        assert "Validation warnings:" in out
+
+    def test_edited_rules_invalidate_cache(self, temp_rules_file, valid_rule, capsys):
+        """Test editing the rules file reloads it and removes the old cache"""
+        rules_file = temp_rules_file(rules_with_name(valid_rule, "Before"))
+        load_engine(rules_file)
+        old_cache = cache_files(rules_file)
+
+        with open(rules_file, "w") as f:
+            json.dump(rules_with_name(valid_rule, "After"), f)
+        capsys.readouterr()
+        engine = load_engine(rules_file)
+
+        assert "from cache" not in capsys.readouterr().out
+        assert [rule["name"] for rule in engine.rules] == ["After"]
+        remaining = cache_files(rules_file)
+        assert len(remaining) == 1 and remaining != old_cache
+
+    def test_engine_code_change_invalidates_cache(
+        self, temp_rules_file, valid_rule, tmp_path, monkeypatch, capsys
+    ):
+        """Test a change to the engine source is not served from a stale cache"""
+        rules_file = temp_rules_file(rules_with_name(valid_rule, "Code change"))
+        source = tmp_path / "engine_source.py"
+        source.write_text("CODE = 1\n")
+        monkeypatch.setattr(process_rules, "_ENGINE_SOURCES", (str(source),))
+        load_engine(rules_file)
+
+        source.write_text("CODE = 2\n")
+        capsys.readouterr()
+        load_engine(rules_file)
+
+        assert "from cache" not in capsys.readouterr().out
+
+    def test_other_rules_files_caches_are_kept(
+        self, temp_rules_file, valid_rule, tmp_path
+    ):
+        """Test stale-cache cleanup only removes this rules file's caches"""
+        rules_file = temp_rules_file(rules_with_name(valid_rule, "Cleanup"))
+        other_cache = tmp_path / f"{os.path.basename(rules_file)}.old.{'0' * 32}.pkl"
+        own_stale = tmp_path / f"{os.path.basename(rules_file)}.{'0' * 32}.pkl"
+        other_cache.write_bytes(b"")
+        own_stale.write_bytes(b"")
+
+        load_engine(rules_file)
+
+        assert other_cache.exists()
+        assert not own_stale.exists()
+
+    def test_cache_is_private(self, temp_rules_file, valid_rule):
+        """Test the cache file is created readable and writable by its owner only"""
+        rules_file = temp_rules_file(rules_with_name(valid_rule, "Private"))
+
+        load_engine(rules_file)
+
+        (cache,) = cache_files(rules_file)
+        mode = os.stat(os.path.join(os.path.dirname(rules_file), cache)).st_mode
+        assert stat.S_IMODE(mode) == 0o600
+
+    def test_writable_cache_is_not_loaded(self, temp_rules_file, valid_rule, capsys):
+        """Test a group-writable cache is rebuilt instead of unpickled"""
+        rules_file = temp_rules_file(rules_with_name(valid_rule, "Shared"))
+        load_engine(rules_file)
+        (cache,) = cache_files(rules_file)
+        cache = os.path.join(os.path.dirname(rules_file), cache)
+        os.chmod(cache, 0o664)
+        capsys.readouterr()
+
+        engine = load_engine(rules_file)
+
+        out = capsys.readouterr().out
+        assert "Ignoring unreadable rules cache" in out
+        assert "from cache" not in out
+        assert [rule["name"] for rule in engine.rules] == ["Shared"]
+        assert stat.S_IMODE(os.stat(cache).st_mode) == 0o600
+
+    def test_cache_of_other_user_is_not_loaded(
+        self, temp_rules_file, valid_rule, capsys, monkeypatch
+    ):
+        """Test a cache owned by a different user is rebuilt instead of unpickled"""
+        rules_file = temp_rules_file(rules_with_name(valid_rule, "Foreign"))
+        load_engine(rules_file)
+        capsys.readouterr()
+        owner = os.getuid()
+        monkeypatch.setattr(os, "getuid", lambda: owner + 1)
+
+        load_engine(rules_file)
+
+        out = capsys.readouterr().out
+        assert "not owned by this user" in out
+        assert "from cache" not in out
+
+
+class TestExecuteAction:
+    """
+    Tests for execute_action and the ActionPlan it applies
+    """
+
+    def test_mark_as_read_removes_unread(self):
+        """Test mark_as_read drops UNREAD and reports the change"""
+        email = {"id": "m1", "labels": ["INBOX", "UNREAD"]}
+
+        assert execute_action(email, {"type": "mark_as_read"}, False) == (True, True)
+        assert email["labels"] == ["INBOX"]
+
+    def test_labels_list_is_replaced_not_edited(self):
+        """Test the original labels list survives for the revert"""
+        original = ["INBOX"]
+        email = {"id": "m1", "labels": original}
+
+        execute_action(email, {"type": "mark_as_unread"}, False)
+
+        assert original == ["INBOX"]
+        assert email["labels"] == ["INBOX", "UNREAD"]
+
+    def test_move_keeps_only_system_labels(self):
+        """Test move_message replaces user labels and INBOX but keeps UNREAD"""
+        email = {"id": "m1", "labels": ["INBOX", "UNREAD", "Work"]}
+        action = {"type": "move_message", "destination": "Archive"}
+
+        assert execute_action(email, action, False) == (True, True)
+        assert email["labels"] == ["UNREAD", "Archive"]
+
+    def test_no_op_action_is_applied_without_change(self):
+        """Test an action that leaves the labels as they were is not a change"""
+        email = {"id": "m1", "labels": ["INBOX"]}
+
+        assert execute_action(email, {"type": "mark_as_read"}, False) == (True, False)
+
+    def test_unknown_action_is_not_applied(self, capsys):
+        """Test an unknown action type is reported and changes nothing"""
+        email = {"id": "m1", "labels": ["INBOX"]}
+
+        assert execute_action(email, {"type": "forward"}, False) == (False, False)
+        assert email["labels"] == ["INBOX"]
+        assert "Unknown action type" in capsys.readouterr().out
+
+
+class TestLabelChanges:
+    """
+    Tests for grouping label changes and sending them through GmailClient
+    """
+
+    def test_same_change_shares_one_group(self):
+        """Test emails with the same (add, remove) diff are queued together"""
+        label_changes = {}
+        first = {"id": "m1", "labels": ["INBOX", "UNREAD"]}
+        second = {"id": "m2", "labels": ["UNREAD", "INBOX", "Work"]}
+        actions = [{"type": "mark_as_read"}]
+
+        assert stage_label_change(first, actions, label_changes, False) == 0
+        assert stage_label_change(second, actions, label_changes, False) == 0
+
+        assert list(label_changes) == [(frozenset(), frozenset({"UNREAD"}))]
+        group = label_changes[(frozenset(), frozenset({"UNREAD"}))]
+        assert [email["id"] for email, _, _ in group] == ["m1", "m2"]
+
+    def test_undone_change_is_not_queued(self):
+        """Test actions that cancel out are counted without a Gmail request"""
+        label_changes = {}
+        email = {"id": "m1", "labels": ["INBOX", "UNREAD"]}
+        actions = [{"type": "mark_as_read"}, {"type": "mark_as_unread"}]
+
+        assert stage_label_change(email, actions, label_changes, False) == 2
+        assert label_changes == {}
+
+    def test_group_is_sent_as_one_batch_modify(self):
+        """Test each group makes one batch_modify call with sorted label lists"""
+        label_changes = {}
+        gmail = MagicMock()
+        gmail.batch_modify.side_effect = lambda ids, add, remove: ids
+        for message_id in ("m1", "m2"):
+            email = {"id": message_id, "labels": ["INBOX", "UNREAD"]}
+            action = {"type": "move_message", "destination": "Archive"}
+            stage_label_change(email, [action], label_changes, False)
+
+        updated, action_count = send_label_changes(gmail, label_changes, False)
+
+        gmail.batch_modify.assert_called_once_with(["m1", "m2"], ["Archive"], ["INBOX"])
+        assert [email["id"] for email in updated] == ["m1", "m2"]
+        assert action_count == 2
+
+    def test_only_failed_emails_are_reverted(self):
+        """Test a partial failure keeps the changes Gmail did apply"""
+        label_changes = {}
+        emails = [{"id": f"m{i}", "labels": ["INBOX", "UNREAD"]} for i in range(3)]
+        for email in emails:
+            stage_label_change(email, [{"type": "mark_as_read"}], label_changes, False)
+        gmail = MagicMock()
+        gmail.batch_modify.return_value = ["m0", "m2"]
+
+        updated, action_count = send_label_changes(gmail, label_changes, False)
+
+        assert [email["id"] for email in updated] == ["m0", "m2"]
+        assert action_count == 2
+        assert emails[0]["labels"] == ["INBOX"]
+        assert emails[1]["labels"] == ["INBOX", "UNREAD"]
+        assert emails[2]["labels"] == ["INBOX"]
@@ -1,7 +1,8 @@
+import json
 import pytest
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from src.rule_engine import RuleEngine
-from src.rule_validator import RuleValidator, RuleValidationError
+from src.rule_validator import RuleValidationError
 
 
 class TestRuleEvaluation:
@@ -175,6 +176,42 @@ class TestRuleEvaluation:
         old_email = {"received_date": datetime.now() - timedelta(days=10)}
         assert engine.evaluate_rules(old_email) != []
 
+    def test_date_threshold_follows_set_now(self, temp_rules_file):
+        """Test that date conditions use the clock captured by set_now"""
+        rules = {
+            "rules": [
+                {
+                    "name": "Recent",
+                    "predicate": "all",
+                    "conditions": [
+                        {
+                            "field": "received_date",
+                            "predicate": "less_than",
+                            "value": 1,
+                            "unit": "days",
+                        }
+                    ],
+                    "actions": [{"type": "mark_as_read"}],
+                }
+            ]
+        }
+        rules_file = temp_rules_file(rules)
+        engine = RuleEngine(rules_file)
+
+        email = {"received_date": datetime.now() - timedelta(hours=2)}
+        assert len(engine.evaluate_rules(email)) == 1
+        assert (
+            len(
+                engine.evaluate_rules(
+                    {"received_date": email["received_date"].isoformat()}
+                )
+            )
+            == 1
+        )
+
+        engine.set_now(datetime.now(timezone.utc) + timedelta(days=1))
+        assert engine.evaluate_rules(email) == []
+
     def test_date_months_unit(self, temp_rules_file):
         """Test date predicate with months unit"""
         rules = {
@@ -271,6 +308,39 @@ class TestRuleEvaluation:
         email4 = {"from": "colleague@company.com", "subject": "Normal email"}
         assert engine.evaluate_rules(email4) == []
 
+    def test_any_predicate_with_several_equals_on_one_field(self, temp_rules_file):
+        """Test 'any' rule listing several exact senders"""
+        senders = ["boss@company.com", "cto@company.com", "ceo@company.com"]
+        rules = {
+            "rules": [
+                {
+                    "name": "Test",
+                    "predicate": "any",
+                    "conditions": [
+                        {"field": "from", "predicate": "equals", "value": sender}
+                        for sender in senders
+                    ]
+                    + [
+                        {"field": "subject", "predicate": "contains", "value": "urgent"}
+                    ],
+                    "actions": [{"type": "mark_as_read"}],
+                }
+            ]
+        }
+
+        rules_file = temp_rules_file(rules)
+        engine = RuleEngine(rules_file)
+
+        for sender in senders:
+            email = {"from": sender.upper(), "subject": "Normal email"}
+            assert engine.evaluate_rules(email) != []
+
+        email = {"from": "colleague@company.com", "subject": "Urgent matter"}
+        assert engine.evaluate_rules(email) != []
+
+        email = {"from": "colleague@company.com", "subject": "Normal email"}
+        assert engine.evaluate_rules(email) == []
+
     def test_multiple_rules_all_evaluated(self, temp_rules_file):
         """Test that all rules are evaluated"""
         rules = {
@@ -303,6 +373,148 @@ class TestRuleEvaluation:
         assert any(a["type"] == "mark_as_read" for a in actions)
         assert any(a["type"] == "mark_as_unread" for a in actions)
 
+    def test_indexed_evaluation_matches_full_scan(self, temp_rules_file):
+        """Test that the rule indexes return the same actions as a full scan"""
+        rules = {
+            "rules": [
+                {
+                    "name": "Boss",
+                    "predicate": "all",
+                    "conditions": [
+                        {
+                            "field": "from",
+                            "predicate": "equals",
+                            "value": "Boss@Company.com",
+                        },
+                        {
+                            "field": "subject",
+                            "predicate": "contains",
+                            "value": "report",
+                        },
+                    ],
+                    "actions": [{"type": "mark_as_unread"}],
+                },
+                {
+                    "name": "Either sender",
+                    "predicate": "any",
+                    "conditions": [
+                        {"field": "from", "predicate": "equals", "value": "a@x.com"},
+                        {"field": "subject", "predicate": "equals", "value": "hello"},
+                    ],
+                    "actions": [{"type": "move_message", "destination": "Friends"}],
+                },
+                {
+                    "name": "Report or b",
+                    "predicate": "any",
+                    "conditions": [
+                        {
+                            "field": "subject",
+                            "predicate": "contains",
+                            "value": "report",
+                        },
+                        {"field": "from", "predicate": "equals", "value": "b@x.com"},
+                    ],
+                    "actions": [{"type": "mark_as_read"}],
+                },
+                {
+                    "name": "Newsletter",
+                    "predicate": "all",
+                    "conditions": [
+                        {"field": "from", "predicate": "contains", "value": "News"},
+                        {
+                            "field": "message",
+                            "predicate": "contains",
+                            "value": "unsubscribe",
+                        },
+                    ],
+                    "actions": [{"type": "move_message", "destination": "News"}],
+                },
+                {
+                    "name": "Scanned",
+                    "predicate": "any",
+                    "conditions": [
+                        {
+                            "field": "subject",
+                            "predicate": "does_not_contain",
+                            "value": "report",
+                        },
+                        {"field": "from", "predicate": "contains", "value": "x.com"},
+                    ],
+                    "actions": [{"type": "mark_as_read"}],
+                },
+            ]
+        }
+
+        rules_file = temp_rules_file(rules)
+        engine = RuleEngine(rules_file)
+
+        emails = [
+            {"from": " boss@company.com ", "subject": "Weekly report"},
+            {"from": "boss@company.com", "subject": "Lunch"},
+            {"from": "a@x.com", "subject": "Report"},
+            {"from": "c@x.com", "subject": "HELLO"},
+            {"from": "b@x.com"},
+            {"subject": None},
+            {"from": "news@shop.com", "subject": "Report", "message": "Unsubscribe"},
+            {"from": "news@shop.com", "message": "hello"},
+        ]
+        for email in emails:
+            assert engine.evaluate_rules_indexed(email) == engine.evaluate_rules(email)
+        assert engine.evaluate_rules_batch(emails + emails) == [
+            engine.evaluate_rules(email) for email in emails + emails
+        ]
+
+    def test_unchanged_rules_file_is_validated_once(
+        self, temp_rules_file, valid_rule, capsys
+    ):
+        """Test that engines share validation until the rules file changes"""
+        # A name no other test uses, as validation is shared by file contents
+        rule = dict(valid_rule, name="Validated once")
+        rules_file = temp_rules_file({"rules": [rule]})
+
+        RuleEngine(rules_file)
+        assert "Validating rules file" in capsys.readouterr().out
+
+        engine = RuleEngine(rules_file)
+        assert "Validating rules file" not in capsys.readouterr().out
+        assert engine.rules[0]["name"] == rule["name"]
+
+        with open(rules_file, "w") as f:
+            json.dump({"rules": [rule, dict(rule, name="Validated twice")]}, f)
+        engine = RuleEngine(rules_file)
+        assert "Validating rules file" in capsys.readouterr().out
+        assert len(engine.rules) == 2
+
+    def test_identical_rules_files_share_validation(
+        self, temp_rules_file, valid_rule, capsys
+    ):
+        """Test that rules files with the same contents are validated once"""
+        rules = {"rules": [dict(valid_rule, name="Shared validation")]}
+
+        RuleEngine(temp_rules_file(rules))
+        assert "Validating rules file" in capsys.readouterr().out
+
+        engine = RuleEngine(temp_rules_file(rules))
+        assert "Validating rules file" not in capsys.readouterr().out
+        assert engine.rules[0]["name"] == "Shared validation"
+
+    def test_needs_body_only_when_message_is_checked(self, temp_rules_file):
+        """Test that needs_body reflects whether any rule checks the message"""
+
+        def rule(field):
+            return {
+                "name": f"Rule on {field}",
+                "predicate": "all",
+                "conditions": [{"field": field, "predicate": "contains", "value": "x"}],
+                "actions": [{"type": "mark_as_read"}],
+            }
+
+        engine = RuleEngine(temp_rules_file({"rules": [rule("from"), rule("subject")]}))
+        assert engine.needs_body is False
+
+        engine = RuleEngine(temp_rules_file({"rules": [rule("from"), rule("message")]}))
+        assert engine.needs_body is True
+
 
 class TestRuleEvaluationEdgeCases:
     """
@@ -508,16 +720,15 @@ class TestRuleValidation:
     Tests for rule validation
     """
 
-    def test_valid_rule_passes(self, temp_rules_file, valid_rule):
+    def test_valid_rule_passes(self, temp_rules_file, valid_rule, validator):
         """Test that valid rule passes validation"""
         rules = {"rules": [valid_rule]}
         rules_file = temp_rules_file(rules)
 
-        validator = RuleValidator()
-        assert validator.validate_rules_file(rules_file) == True
+        assert validator.validate_rules_file(rules_file) is True
         assert len(validator.errors) == 0
 
-    def test_invalid_json_fails(self, temp_rules_file):
+    def test_invalid_json_fails(self, temp_rules_file, validator):
         """Test that invalid JSON is caught"""
         import tempfile
 
@@ -525,32 +736,27 @@ class TestRuleValidation:
         temp_file.write("{ invalid json }")
         temp_file.close()
 
-        validator = RuleValidator()
         result = validator.validate_rules_file(temp_file.name)
-        assert result == False
+        assert result is False
         assert len(validator.errors) > 0
 
-    def test_missing_rules_key(self, temp_rules_file):
+    def test_missing_rules_key(self, validator):
         """Test missing 'rules' key"""
         data = {"not_rules": []}
-        rules_file = temp_rules_file(data)
 
-        validator = RuleValidator()
-        result = validator.validate_rules_file(rules_file)
-        assert result == False
+        result = validator.validate_rules(data)
+        assert result is False
         assert any("'rules'" in e for e in validator.errors)
 
-    def test_empty_rules_array(self, temp_rules_file):
+    def test_empty_rules_array(self, validator):
         """Test empty rules array"""
         rules = {"rules": []}
-        rules_file = temp_rules_file(rules)
 
-        validator = RuleValidator()
-        result = validator.validate_rules_file(rules_file)
-        assert result == True
+        result = validator.validate_rules(rules)
+        assert result is True
         assert len(validator.warnings) > 0
 
-    def test_missing_required_rule_fields(self, temp_rules_file):
+    def test_missing_required_rule_fields(self, validator):
         """Test missing required fields in rule"""
         rules = {
             "rules": [
@@ -560,21 +766,18 @@ class TestRuleValidation:
                 }
             ]
         }
-        rules_file = temp_rules_file(rules)
 
-        validator = RuleValidator()
         with pytest.raises(RuleValidationError):
-            validator.validate_rules_file(rules_file)
+            validator.validate_rules(rules)
 
         assert len(validator.errors) >= 3
 
-    def test_invalid_field_name(self, temp_rules_file):
+    def test_invalid_field_name(self, valid_rule, validator):
         """Test invalid field name in condition"""
         rules = {
             "rules": [
                 {
-                    "name": "Test",
-                    "predicate": "all",
+                    **valid_rule,
                     "conditions": [
                         {
                             "field": "sender",  # Invalid, should be "from"
@@ -582,25 +785,21 @@ class TestRuleValidation:
                             "value": "test",
                         }
                     ],
-                    "actions": [{"type": "mark_as_read"}],
                 }
             ]
         }
-        rules_file = temp_rules_file(rules)
 
-        validator = RuleValidator()
         with pytest.raises(RuleValidationError):
-            validator.validate_rules_file(rules_file)
+            validator.validate_rules(rules)
 
         assert any("Invalid field 'sender'" in e for e in validator.errors)
 
-    def test_invalid_predicate_for_string_field(self, temp_rules_file):
+    def test_invalid_predicate_for_string_field(self, valid_rule, validator):
         """Test using date predicate on string field"""
         rules = {
             "rules": [
                 {
-                    "name": "Test",
-                    "predicate": "all",
+                    **valid_rule,
                     "conditions": [
                         {
                             "field": "from",  # String field
@@ -608,25 +807,21 @@ class TestRuleValidation:
                             "value": "30",
                         }
                     ],
-                    "actions": [{"type": "mark_as_read"}],
                 }
             ]
         }
-        rules_file = temp_rules_file(rules)
 
-        validator = RuleValidator()
         with pytest.raises(RuleValidationError):
-            validator.validate_rules_file(rules_file)
+            validator.validate_rules(rules)
 
         assert any("Invalid predicate" in e for e in validator.errors)
 
-    def test_invalid_predicate_for_date_field(self, temp_rules_file):
+    def test_invalid_predicate_for_date_field(self, valid_rule, validator):
         """Test using string predicate on date field"""
         rules = {
             "rules": [
                 {
-                    "name": "Test",
-                    "predicate": "all",
+                    **valid_rule,
                     "conditions": [
                         {
                             "field": "received_date",  # Date field
@@ -634,23 +829,19 @@ class TestRuleValidation:
                             "value": "test",
                         }
                     ],
-                    "actions": [{"type": "mark_as_read"}],
                 }
             ]
         }
-        rules_file = temp_rules_file(rules)
 
-        validator = RuleValidator()
         with pytest.raises(RuleValidationError):
-            validator.validate_rules_file(rules_file)
+            validator.validate_rules(rules)
 
-    def test_date_condition_missing_unit(self, temp_rules_file):
+    def test_date_condition_missing_unit(self, valid_rule, validator):
         """Test date condition without unit field"""
         rules = {
             "rules": [
                 {
-                    "name": "Test",
-                    "predicate": "all",
+                    **valid_rule,
                     "conditions": [
                         {
                             "field": "received_date",
@@ -659,25 +850,21 @@ class TestRuleValidation:
                             # Missing: unit
                         }
                     ],
-                    "actions": [{"type": "mark_as_read"}],
                 }
             ]
         }
-        rules_file = temp_rules_file(rules)
 
-        validator = RuleValidator()
         with pytest.raises(RuleValidationError):
-            validator.validate_rules_file(rules_file)
+            validator.validate_rules(rules)
 
         assert any("require 'unit'" in e for e in validator.errors)
 
-    def test_date_condition_invalid_unit(self, temp_rules_file):
+    def test_date_condition_invalid_unit(self, valid_rule, validator):
         """Test date condition with invalid unit"""
         rules = {
             "rules": [
                 {
-                    "name": "Test",
-                    "predicate": "all",
+                    **valid_rule,
                     "conditions": [
                         {
                             "field": "received_date",
@@ -686,23 +873,19 @@ class TestRuleValidation:
                             "unit": "years",  # Invalid
                         }
                     ],
-                    "actions": [{"type": "mark_as_read"}],
                 }
             ]
         }
-        rules_file = temp_rules_file(rules)
 
-        validator = RuleValidator()
         with pytest.raises(RuleValidationError):
-            validator.validate_rules_file(rules_file)
+            validator.validate_rules(rules)
 
-    def test_date_value_non_numeric(self, temp_rules_file):
+    def test_date_value_non_numeric(self, valid_rule, validator):
         """Test date value that's not numeric"""
         rules = {
             "rules": [
                 {
-                    "name": "Test",
-                    "predicate": "all",
+                    **valid_rule,
                     "conditions": [
                         {
                             "field": "received_date",
@@ -711,25 +894,21 @@ class TestRuleValidation:
                             "unit": "days",
                         }
                     ],
-                    "actions": [{"type": "mark_as_read"}],
                 }
             ]
         }
-        rules_file = temp_rules_file(rules)
 
-        validator = RuleValidator()
         with pytest.raises(RuleValidationError):
-            validator.validate_rules_file(rules_file)
+            validator.validate_rules(rules)
 
         assert any("must be numeric" in e for e in validator.errors)
 
-    def test_date_value_negative(self, temp_rules_file):
+    def test_date_value_negative(self, valid_rule, validator):
         """Test negative date value"""
         rules = {
             "rules": [
                 {
-                    "name": "Test",
-                    "predicate": "all",
+                    **valid_rule,
                     "conditions": [
                         {
                             "field": "received_date",
@@ -738,50 +917,37 @@ class TestRuleValidation:
                             "unit": "days",
                         }
                     ],
-                    "actions": [{"type": "mark_as_read"}],
                 }
             ]
         }
-        rules_file = temp_rules_file(rules)
 
-        validator = RuleValidator()
         with pytest.raises(RuleValidationError):
-            validator.validate_rules_file(rules_file)
+            validator.validate_rules(rules)
 
         assert any("must be positive" in e for e in validator.errors)
 
-    def test_invalid_action_type(self, temp_rules_file):
+    def test_invalid_action_type(self, valid_rule, validator):
         """Test invalid action type"""
         rules = {
             "rules": [
                 {
-                    "name": "Test",
-                    "predicate": "all",
-                    "conditions": [
-                        {"field": "from", "predicate": "contains", "value": "test"}
-                    ],
+                    **valid_rule,
                     "actions": [{"type": "delete_message"}],  # Invalid
                 }
             ]
         }
-        rules_file = temp_rules_file(rules)
 
-        validator = RuleValidator()
         with pytest.raises(RuleValidationError):
-            validator.validate_rules_file(rules_file)
+            validator.validate_rules(rules)
 
         assert any("Invalid action" in e for e in validator.errors)
 
-    def test_move_message_missing_destination(self, temp_rules_file):
+    def test_move_message_missing_destination(self, valid_rule, validator):
         """Test move_message without destination"""
         rules = {
             "rules": [
                 {
-                    "name": "Test",
-                    "predicate": "all",
-                    "conditions": [
-                        {"field": "from", "predicate": "contains", "value": "test"}
-                    ],
+                    **valid_rule,
                     "actions": [
                         {
                             "type": "move_message"
@@ -791,97 +957,73 @@ class TestRuleValidation:
                 }
             ]
         }
-        rules_file = temp_rules_file(rules)
 
-        validator = RuleValidator()
         with pytest.raises(RuleValidationError):
-            validator.validate_rules_file(rules_file)
+            validator.validate_rules(rules)
 
         assert any("requires 'destination'" in e for e in validator.errors)
 
-    def test_move_message_empty_destination(self, temp_rules_file):
+    def test_move_message_empty_destination(self, valid_rule, validator):
         """Test move_message with empty destination"""
         rules = {
             "rules": [
                 {
-                    "name": "Test",
-                    "predicate": "all",
-                    "conditions": [
-                        {"field": "from", "predicate": "contains", "value": "test"}
-                    ],
+                    **valid_rule,
                     "actions": [{"type": "move_message", "destination": ""}],
                 }
             ]
         }
-        rules_file = temp_rules_file(rules)
 
-        validator = RuleValidator()
         with pytest.raises(RuleValidationError):
-            validator.validate_rules_file(rules_file)
+            validator.validate_rules(rules)
 
         assert any("cannot be empty" in e for e in validator.errors)
 
-    def test_conflicting_read_unread_actions(self, temp_rules_file):
+    def test_conflicting_read_unread_actions(self, valid_rule, validator):
         """Test conflicting mark_as_read and mark_as_unread"""
         rules = {
             "rules": [
                 {
-                    "name": "Test",
-                    "predicate": "all",
-                    "conditions": [
-                        {"field": "from", "predicate": "contains", "value": "test"}
-                    ],
+                    **valid_rule,
                     "actions": [{"type": "mark_as_read"}, {"type": "mark_as_unread"}],
                 }
             ]
         }
-        rules_file = temp_rules_file(rules)
 
-        validator = RuleValidator()
         with pytest.raises(RuleValidationError):
-            validator.validate_rules_file(rules_file)
+            validator.validate_rules(rules)
 
         assert any(
             "both 'mark_as_read' and 'mark_as_unread'" in e.lower()
             for e in validator.errors
         )
 
-    def test_duplicate_mark_as_read_warning(self, temp_rules_file):
+    def test_duplicate_mark_as_read_warning(self, valid_rule, validator):
         """Test duplicate mark_as_read actions generate warning"""
         rules = {
             "rules": [
                 {
-                    "name": "Test",
-                    "predicate": "all",
-                    "conditions": [
-                        {"field": "from", "predicate": "contains", "value": "test"}
-                    ],
+                    **valid_rule,
                     "actions": [{"type": "mark_as_read"}, {"type": "mark_as_read"}],
                 }
             ]
         }
-        rules_file = temp_rules_file(rules)
 
-        validator = RuleValidator()
-        result = validator.validate_rules_file(rules_file)
+        result = validator.validate_rules(rules)
 
-        assert result == True  # Valid but with warning
+        assert result is True  # Valid but with warning
         assert len(validator.warnings) > 0
         assert any(
             "redundant" in w.lower() or "duplicate" in w.lower()
             for w in validator.warnings
         )
 
-    def test_multiple_move_actions_warning(self, temp_rules_file):
+    def test_multiple_move_actions_warning(self, valid_rule, validator):
         """Test multiple move_message actions generate warning"""
         rules = {
             "rules": [
                 {
-                    "name": "Test",
-                    "predicate": "all",
-                    "conditions": [
-                        {"field": "from", "predicate": "contains", "value": "test"}
-                    ],
+                    **valid_rule,
                     "actions": [
                         {"type": "move_message", "destination": "Work"},
                         {"type": "move_message", "destination": "Important"},
@@ -889,86 +1031,77 @@ class TestRuleValidation:
                 }
             ]
         }
-        rules_file = temp_rules_file(rules)
 
-        validator = RuleValidator()
-        result = validator.validate_rules_file(rules_file)
+        result = validator.validate_rules(rules)
 
-        assert result == True  # Valid but with warning
+        assert result is True  # Valid but with warning
         assert len(validator.warnings) > 0
         assert any("multiple" in w.lower() for w in validator.warnings)
 
-    def test_empty_conditions_array(self, temp_rules_file):
-        """Test rule with empty conditions array"""
-        rules = {
-            "rules": [
-                {
-                    "name": "Test",
-                    "predicate": "all",
-                    "conditions": [],  # Empty
-                    "actions": [{"type": "mark_as_read"}],
-                }
-            ]
-        }
-        rules_file = temp_rules_file(rules)
+    @pytest.mark.parametrize(
+        "rule_patch, message",
+        [
+            ({"conditions": []}, "at least one condition"),
+            ({"actions": []}, "at least one action"),
+            ({"predicate": "maybe"}, "'all' or 'any'"),
+        ],
+        ids=["empty_conditions", "empty_actions", "invalid_rule_predicate"],
+    )
+    def test_invalid_rule(self, valid_rule, validator, rule_patch, message):
+        """Test a rule with empty conditions, empty actions or a bad predicate"""
+        rules = {"rules": [{**valid_rule, **rule_patch}]}
 
-        validator = RuleValidator()
         with pytest.raises(RuleValidationError):
-            validator.validate_rules_file(rules_file)
+            validator.validate_rules(rules)
 
-        assert any("at least one condition" in e for e in validator.errors)
+        assert any(message in e for e in validator.errors)
 
-    def test_empty_actions_array(self, temp_rules_file):
-        """Test rule with empty actions array"""
-        rules = {
-            "rules": [
+    @pytest.mark.parametrize(
+        "rule_patch, message",
+        [
+            (
                 {
-                    "name": "Test",
-                    "predicate": "all",
                     "conditions": [
-                        {"field": "from", "predicate": "contains", "value": "test"}
-                    ],
-                    "actions": [],  # Empty
-                }
-            ]
-        }
-        rules_file = temp_rules_file(rules)
-
-        validator = RuleValidator()
-        with pytest.raises(RuleValidationError):
-            validator.validate_rules_file(rules_file)
-
-        assert any("at least one action" in e for e in validator.errors)
-
-    def test_invalid_rule_predicate(self, temp_rules_file):
-        """Test invalid rule-level predicate"""
-        rules = {
-            "rules": [
+                        {"field": "from", "predicate": ["contains"], "value": "x"}
+                    ]
+                },
+                "Invalid predicate '['contains']' for string field",
+            ),
+            (
                 {
-                    "name": "Test",
-                    "predicate": "maybe",  # Invalid
                     "conditions": [
-                        {"field": "from", "predicate": "contains", "value": "test"}
-                    ],
-                    "actions": [{"type": "mark_as_read"}],
-                }
-            ]
-        }
-        rules_file = temp_rules_file(rules)
+                        {
+                            "field": "received_date",
+                            "predicate": "less_than",
+                            "value": "5",
+                            "unit": ["days"],
+                        }
+                    ]
+                },
+                "Invalid unit '['days']'",
+            ),
+            ({"actions": [{"type": {"name": "mark_as_read"}}]}, "Invalid action"),
+            ({"predicate": ["all"]}, "'all' or 'any'"),
+        ],
+        ids=["predicate", "unit", "action_type", "rule_predicate"],
+    )
+    def test_non_string_values_are_reported(
+        self, valid_rule, validator, rule_patch, message
+    ):
+        """Test list/dict values where strings belong fail validation cleanly"""
+        rules = {"rules": [{**valid_rule, **rule_patch}]}
 
-        validator = RuleValidator()
         with pytest.raises(RuleValidationError):
-            validator.validate_rules_file(rules_file)
+            validator.validate_rules(rules)
 
-        assert any("'all' or 'any'" in e for e in validator.errors)
+        assert any(message in e for e in validator.errors)
 
-    def test_very_large_date_value_warning(self, temp_rules_file):
+    def test_very_large_date_value_warning(self, valid_rule, validator):
         """Test that very large date values generate warning"""
         rules = {
             "rules": [
                 {
-                    "name": "Test",
-                    "predicate": "all",
+                    **valid_rule,
                     "conditions": [
                         {
                             "field": "received_date",
@@ -977,18 +1110,15 @@ class TestRuleValidation:
                             "unit": "days",
                         }
                     ],
-                    "actions": [{"type": "mark_as_read"}],
                 }
             ]
         }
-        rules_file = temp_rules_file(rules)
 
-        validator = RuleValidator()
-        result = validator.validate_rules_file(rules_file)
+        result = validator.validate_rules(rules)
 
-        assert result == True
+        assert result is True
 
-    def test_unicode_in_rule_name(self, temp_rules_file):
+    def test_unicode_in_rule_name(self, validator):
         """Test rule with unicode in name"""
         rules = {
             "rules": [
@@ -1002,8 +1132,6 @@ class TestRuleValidation:
                 }
             ]
         }
-        rules_file = temp_rules_file(rules)
 
-        validator = RuleValidator()
-        result = validator.validate_rules_file(rules_file)
-        assert result == True
+        result = validator.validate_rules(rules)
+        assert result is True